@@ -0,0 +1,61 @@
+"""
+Set up shared by the benchmarks which use modules of the app. Import it before anything from src, it puts src on the
+path.
+"""
+
+import atexit
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+
+def use_temporary_app_dir(app_dir: str | None = None) -> str:
+    """
+    Points the settings directory of the app, and so its db, at app_dir or a new temporary directory which is removed
+    on exit, so that benchmarks never touch the real one. Has to be called before config_paths is imported
+    """
+    from PySide6.QtCore import QSettings
+
+    if app_dir is None:
+        app_dir = tempfile.mkdtemp(prefix="koncentro-benchmark-")
+        atexit.register(shutil.rmtree, app_dir, ignore_errors=True)
+    QSettings.setPath(QSettings.Format.IniFormat, QSettings.Scope.UserScope, app_dir)
+    return app_dir
+
+
+def create_db():
+    """Creates the db by running the migrations and adds the default workspace, like the app does on start up"""
+    from alembic import command
+    from alembic.config import Config
+
+    from utils.check_valid_db import checkValidDB
+
+    command.upgrade(Config(SRC_DIR.parent / "alembic.ini"), "head")
+    checkValidDB()
+
+
+def add_tasks(count: int, task_type=None, elapsed_time: int = 0) -> list[int]:
+    """Adds count tasks to the current workspace and returns their ids"""
+    from models.db_tables import Task, TaskType
+    from models.workspace_lookup import WorkspaceLookup
+    from utils.db_utils import get_session
+
+    workspace_id = WorkspaceLookup.get_current_workspace_id()
+    with get_session() as session:
+        tasks = [
+            Task(
+                workspace_id=workspace_id,
+                task_name=f"Task {i}",
+                task_type=task_type or TaskType.TODO,
+                task_position=i,
+                elapsed_time=elapsed_time,
+            )
+            for i in range(count)
+        ]
+        session.add_all(tasks)
+        session.flush()
+        return [task.id for task in tasks]
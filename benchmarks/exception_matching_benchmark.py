@@ -0,0 +1,93 @@
+"""
+Measures the per request cost of UrlMatcher.matches() as the exception list grows. The blocklist is the same in every
+case, the exception list holds subdomains and path prefixes of blocked sites. Requests are split into misses, which
+match no rule and never look at the exceptions, blocked requests, which match a rule and are looked up in the
+exceptions without matching one, and excepted requests, which match both. No DecisionCache is involved, every request
+is matched from scratch.
+
+    python benchmarks/exception_matching_benchmark.py --rules 10000 --exception-counts 0 100 10000 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from website_blocker.rule_compiler import compile_rules  # noqa: E402
+from website_blocker.url_matcher import UrlMatcher  # noqa: E402
+
+SAMPLE_SIZE = 1000  # distinct requests per kind
+
+
+def exception_addresses(count: int, rule_count: int) -> list[str]:
+    """Half subdomains and half path prefixes of blocked sites"""
+    return [
+        f"docs{i}.blocked{i % rule_count}.com" if i % 2 == 0 else f"blocked{i % rule_count}.com/allowed{i}"
+        for i in range(count)
+    ]
+
+
+def sample_requests(rule_count: int, min_exception_count: int) -> dict[str, list[tuple[str, str]]]:
+    requests = {
+        "miss": [(f"www.site{i}.org", f"https://www.site{i}.org/a/b?q={i}") for i in range(SAMPLE_SIZE)],
+        "blocked": [
+            (f"www.blocked{i % rule_count}.com", f"https://www.blocked{i % rule_count}.com/a/b?q={i}")
+            for i in range(SAMPLE_SIZE)
+        ],
+    }
+    if min_exception_count:  # exceptions every case has
+        excepted = []
+        for address in exception_addresses(min(min_exception_count, SAMPLE_SIZE), rule_count):
+            host, _, path = address.partition("/")
+            excepted.append((host, f"https://{host}/{path}/page" if path else f"https://{host}/page"))
+        requests["excepted"] = excepted
+    return requests
+
+
+def nanoseconds_per_request(matcher: UrlMatcher, requests: list[tuple[str, str]], rounds: int) -> float:
+    matches = matcher.matches
+    started_at = time.perf_counter_ns()
+    for _ in range(rounds):
+        for host, url in requests:
+            matches(host, url)
+    return round((time.perf_counter_ns() - started_at) / (rounds * len(requests)), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cost of exception lists per matched request.")
+    parser.add_argument("--rules", type=int, default=10_000, help="blocked sites")
+    parser.add_argument("--exception-counts", nargs="+", type=int, default=[0, 100, 10_000, 100_000])
+    parser.add_argument("--rounds", type=int, default=200, help="times every sample request is matched")
+    args = parser.parse_args()
+
+    rules = compile_rules(f"blocked{i}.com" for i in range(args.rules))
+    min_exception_count = min(count for count in args.exception_counts if count) if any(args.exception_counts) else 0
+    requests = sample_requests(args.rules, min_exception_count)
+
+    results = {}
+    for exception_count in args.exception_counts:
+        print(f"Benchmarking {exception_count} exceptions", file=sys.stderr)
+        exception_rules = compile_rules(exception_addresses(exception_count, args.rules)) if exception_count else None
+        matcher = UrlMatcher.from_rules(rules, exception_rules)
+        # without exceptions the excepted requests are blocked ones as well
+        case_requests = {
+            kind: kind_requests for kind, kind_requests in requests.items() if exception_count or kind != "excepted"
+        }
+        for kind, kind_requests in case_requests.items():
+            expected = kind == "blocked"
+            if any(matcher.matches(host, url) != expected for host, url in kind_requests):
+                print(f"{kind} requests aren't matched as expected", file=sys.stderr)
+                sys.exit(1)
+        results[exception_count] = {
+            kind: nanoseconds_per_request(matcher, kind_requests, args.rounds)
+            for kind, kind_requests in case_requests.items()
+        }
+
+    print(json.dumps({"rules": args.rules, "nanoseconds_per_request": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Measures what the website filter costs. Starts each filtering engine against a local stand-in origin server, drives
+concurrent load through it with rule sets of different sizes and reports requests per second, latency added on top of
+requesting the origin directly, CPU time and RSS of the engine. Results are written as JSON, so that they can be
+compared across versions.
+
+    python benchmarks/proxy_benchmark.py --engines mitmdump asyncio --rule-counts 100 10000 500000 -o results.json
+
+Requests go to an allowed host in blocklist mode, so every request is proxied to the origin and the whole rule set has
+to be looked at. With --cert and --key the origin serves HTTPS as well and requests are tunneled through CONNECT.
+When both engines are run, the report compares the asyncio engine with mitmdump for every rule count, as ratios of
+asyncio to mitmdump. Needs psutil from the benchmark dependency group:
+
+    poetry install --with benchmark
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shlex
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import psutil
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from constants import MITMDUMP_COMMAND_LINUX, MITMDUMP_COMMAND_WINDOWS, MITMDUMP_CONTROL_URL  # noqa: E402
+from website_blocker.rule_compiler import compile_rules  # noqa: E402
+from website_blocker.rule_file import write_rule_file  # noqa: E402
+
+ENGINES = ["mitmdump", "asyncio"]
+ENGINE_READY_TIMEOUT = 30  # in seconds
+RESPONSE_BODY = b"x" * 1024
+
+
+class OriginRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OriginServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # default backlog of 5 makes the origin itself the bottleneck under load
+
+
+def start_origin(ssl_context: ssl.SSLContext | None = None) -> OriginServer:
+    server = OriginServer(("127.0.0.1", 0), OriginRequestHandler)
+    if ssl_context is not None:
+        server.socket = ssl_context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_rules(rules_dir: str, rule_count: int) -> float:
+    """Writes a blocklist of rule_count hosts, none of which is the origin. Returns how long compiling took"""
+    started_at = time.perf_counter()
+    rules = compile_rules(f"site{i}.example.com" for i in range(rule_count))
+    write_rule_file(rules_dir, rules)
+    return time.perf_counter() - started_at
+
+
+def start_engine(engine: str, port: int, rules_dir: str, mitmdump_path: str | None) -> subprocess.Popen:
+    if engine == "mitmdump":
+        command = MITMDUMP_COMMAND_WINDOWS if os.name == "nt" else MITMDUMP_COMMAND_LINUX
+        args = shlex.split(command.format(mitmdump_path, port), posix=os.name != "nt")
+        # origin's certificate is self signed
+        args += ["--set", f"rules_dir={rules_dir}", "--set", "filtering_enabled=false", "--set", "ssl_insecure=true"]
+    else:
+        # separate process, so that the load generator doesn't count towards its CPU time
+        args = [sys.executable, __file__, "--serve-asyncio", str(port), rules_dir]
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def enable_filtering(port: int) -> bool:
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": f"http://127.0.0.1:{port}"}))
+    request = urllib.request.Request(
+        MITMDUMP_CONTROL_URL,
+        data=json.dumps({"filtering_enabled": True, "block_type": "blocklist"}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with opener.open(request, timeout=2) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def wait_until_ready(process: subprocess.Popen, port: int):
+    started_at = time.monotonic()
+    while time.monotonic() - started_at < ENGINE_READY_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f"Engine exited with return code {process.returncode} while starting")
+        if enable_filtering(port):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"Engine didn't become ready within {ENGINE_READY_TIMEOUT} seconds")
+
+
+async def send_request(origin_port: int, proxy_port: int | None, tls_context: ssl.SSLContext | None) -> float:
+    """Sends a single request on a new connection and returns its latency in seconds"""
+    started_at = time.perf_counter()
+    if proxy_port is None:
+        reader, writer = await asyncio.open_connection("127.0.0.1", origin_port, ssl=tls_context)
+        target = "/"
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy_port)
+        target = f"http://localhost:{origin_port}/"
+        if tls_context is not None:
+            writer.write(f"CONNECT localhost:{origin_port} HTTP/1.1\r\nHost: localhost:{origin_port}\r\n\r\n".encode())
+            await writer.drain()
+            if b" 200 " not in await reader.readuntil(b"\r\n\r\n"):
+                raise ConnectionError("CONNECT was refused")
+            await writer.start_tls(tls_context, server_hostname="localhost")
+            target = "/"
+
+    try:
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost:{origin_port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        if not head.startswith(b"HTTP/1.1 200") and not head.startswith(b"HTTP/1.0 200"):
+            raise ConnectionError(head.split(b"\r\n", 1)[0].decode())
+        await reader.readexactly(len(RESPONSE_BODY))
+    finally:
+        writer.close()
+    return time.perf_counter() - started_at
+
+
+async def drive_load(
+    origin_port: int, proxy_port: int | None, tls_context, request_count: int, concurrency: int
+) -> tuple[list[float], int, float]:
+    """Returns latencies of the successful requests, the number of failed ones and the total duration"""
+    latencies = []
+    errors = 0
+    remaining = iter(range(request_count))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            try:
+                latencies.append(await send_request(origin_port, proxy_port, tls_context))
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started_at
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def to_ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run_case(args, engine: str, rule_count: int, origin_port: int, tls_context, baseline: dict) -> dict:
+    with tempfile.TemporaryDirectory() as rules_dir:
+        compile_time = write_rules(rules_dir, rule_count)
+        process = start_engine(engine, args.port, rules_dir, args.mitmdump)
+        try:
+            wait_until_ready(process, args.port)
+            engine_process = psutil.Process(process.pid)
+            # warm up, so that start up costs and caches don't skew the results
+            asyncio.run(drive_load(origin_port, args.port, tls_context, args.concurrency, args.concurrency))
+
+            cpu_before = engine_process.cpu_times()
+            latencies, errors, duration = asyncio.run(
+                drive_load(origin_port, args.port, tls_context, args.requests, args.concurrency)
+            )
+            cpu_after = engine_process.cpu_times()
+            rss = engine_process.memory_info().rss
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    cpu_seconds = (cpu_after.user + cpu_after.system) - (cpu_before.user + cpu_before.system)
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    return {
+        "engine": engine,
+        "rule_count": rule_count,
+        "https": tls_context is not None,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "latency_ms": {"p50": to_ms(p50), "p99": to_ms(p99)},
+        "added_latency_ms": {
+            "p50": to_ms(p50 - baseline["p50"]) if p50 is not None else None,
+            "p99": to_ms(p99 - baseline["p99"]) if p99 is not None else None,
+        },
+        "cpu_seconds": round(cpu_seconds, 3),
+        "cpu_percent": round(cpu_seconds / duration * 100, 1),
+        "rss_bytes": rss,
+        "rule_compile_seconds": round(compile_time, 3),
+    }
+
+
+def compare_engines(results: list[dict]) -> list[dict]:
+    """Ratios of the asyncio engine to mitmdump for every rule count both were run with, below 1 means less"""
+    mitmdump_results = {result["rule_count"]: result for result in results if result["engine"] == "mitmdump"}
+
+    def ratio(value, mitmdump_value):
+        return round(value / mitmdump_value, 3) if value is not None and mitmdump_value else None
+
+    comparison = []
+    for result in results:
+        mitmdump_result = mitmdump_results.get(result["rule_count"])
+        if result["engine"] != "asyncio" or mitmdump_result is None:
+            continue
+        comparison.append(
+            {
+                "rule_count": result["rule_count"],
+                "requests_per_second": ratio(result["requests_per_second"], mitmdump_result["requests_per_second"]),
+                "added_latency_p50": ratio(
+                    result["added_latency_ms"]["p50"], mitmdump_result["added_latency_ms"]["p50"]
+                ),
+                "added_latency_p99": ratio(
+                    result["added_latency_ms"]["p99"], mitmdump_result["added_latency_ms"]["p99"]
+                ),
+                "cpu_seconds": ratio(result["cpu_seconds"], mitmdump_result["cpu_seconds"]),
+                "rss_bytes": ratio(result["rss_bytes"], mitmdump_result["rss_bytes"]),
+            }
+        )
+    return comparison
+
+
+def serve_asyncio(port: int, rules_dir: str):
+    from website_blocker.asyncio_proxy import AsyncioProxy
+
+    AsyncioProxy(port, rules_dir).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the filtering engines of the website filter.")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument("--rule-counts", nargs="+", type=int, default=[100, 10_000, 500_000])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per case")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=18080, help="port the engines listen on")
+    parser.add_argument("--mitmdump", help="path of the mitmdump executable, looked up like the app does by default")
+    parser.add_argument("--cert", help="certificate of the origin, requests are sent over HTTPS if given")
+    parser.add_argument("--key", help="private key of the certificate of the origin")
+    parser.add_argument("-o", "--output", help="file to write the results to, stdout by default")
+    parser.add_argument("--serve-asyncio", nargs=2, metavar=("PORT", "RULES_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_asyncio:
+        serve_asyncio(int(args.serve_asyncio[0]), args.serve_asyncio[1])
+        return
+
+    if "mitmdump" in args.engines and args.mitmdump is None:
+        from utils.find_mitmdump_executable import get_mitmdump_path
+
+        args.mitmdump = get_mitmdump_path()
+        if args.mitmdump is None:
+            parser.error("mitmdump wasn't found, pass its path with --mitmdump")
+
+    server_context = tls_context = None
+    if args.cert:
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(args.cert, args.key)
+        tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        tls_context.check_hostname = False
+        tls_context.verify_mode = ssl.CERT_NONE  # mitmdump presents its own certificate
+    origin = start_origin(server_context)
+    origin_port = origin.server_address[1]
+
+    latencies, errors, _ = asyncio.run(drive_load(origin_port, None, tls_context, args.requests, args.concurrency))
+    baseline = {"p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99)}
+
+    results = []
+    for engine in args.engines:
+        for rule_count in args.rule_counts:
+            print(f"Benchmarking {engine} with {rule_count} rules", file=sys.stderr)
+            results.append(run_case(args, engine, rule_count, origin_port, tls_context, baseline))
+
+    from utils.get_app_version import get_app_version
+
+    report = {
+        "app_version": get_app_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "direct_latency_ms": {"p50": to_ms(baseline["p50"]), "p99": to_ms(baseline["p99"]), "errors": errors},
+        "results": results,
+        "asyncio_to_mitmdump": compare_engines(results),
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    origin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Query plan regression check of the indexes on tasks and the URL lists. Runs TaskListModel.load_data(), its keyset
+pagination in fetchMore() and WebsiteListManager.remove_urls() against a db created through the migrations, records the
+statements they execute and asserts that EXPLAIN QUERY PLAN of every one of them searches through the expected index
+instead of scanning the table.
+
+    python benchmarks/query_plan_check.py
+
+Exits with a non zero return code if any statement doesn't use its index.
+"""
+
+import sys
+from contextlib import contextmanager
+
+from benchmark_utils import add_tasks, create_db, use_temporary_app_dir
+
+
+@contextmanager
+def recorded_statements(engine, table: str):
+    """Collects the SELECT and DELETE statements on table executed within the block, along with their parameters"""
+    from sqlalchemy import event
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        is_query = statement.lstrip().upper().startswith(("SELECT", "DELETE"))
+        if is_query and not executemany and f"FROM {table}" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def query_plan(engine, statement: str, parameters) -> list[str]:
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        return [row[-1] for row in rows]  # detail column
+    finally:
+        connection.close()
+
+
+def main():
+    use_temporary_app_dir()
+    create_db()
+    task_ids = add_tasks(500)
+
+    from PySide6.QtWidgets import QApplication
+
+    from models.db_tables import (
+        AllowlistExceptionURL,
+        AllowlistURL,
+        BlocklistExceptionURL,
+        BlocklistURL,
+        Task,
+        TaskType,
+        engine,
+    )
+    from models.task_list_model import TaskListModel
+    from models.website_list_manager_model import WebsiteListManager
+    from models.workspace_lookup import WorkspaceLookup
+    from utils.db_utils import get_session
+
+    app = QApplication.instance() or QApplication([])  # noqa: F841
+    with get_session() as session:  # half of the tasks completed, so that the task type is worth filtering on
+        session.query(Task).filter(Task.id.in_(task_ids[::2])).update(
+            {"task_type": TaskType.COMPLETED}, synchronize_session=False
+        )
+
+    checks = []  # (what was run, table, expected index, recorded statements)
+
+    with recorded_statements(engine, "tasks") as statements:
+        completed_tasks = TaskListModel(TaskType.COMPLETED)
+    checks.append(("TaskListModel.load_data", "tasks", "ix_tasks_workspace_id_task_type_task_position", statements))
+
+    with recorded_statements(engine, "tasks") as statements:
+        completed_tasks.fetchMore()
+    checks.append(("TaskListModel.fetchMore", "tasks", "ix_tasks_workspace_id_task_type_task_position", statements))
+
+    website_list_manager = WebsiteListManager()
+    workspace_id = WorkspaceLookup.get_current_workspace_id()
+    for url_class in (BlocklistURL, BlocklistExceptionURL, AllowlistURL, AllowlistExceptionURL):
+        table = url_class.__tablename__
+        with get_session() as session:
+            session.add_all(url_class(workspace_id=workspace_id, url=f"site{i}.example.com") for i in range(200))
+        with recorded_statements(engine, table) as statements, get_session() as session:
+            website_list_manager.remove_urls(session, {"site1.example.com", "site2.example.com"}, url_class)
+        checks.append(
+            (f"WebsiteListManager.remove_urls({url_class.__name__})", table, f"ix_{table}_workspace_id_url", statements)
+        )
+
+    failures = 0
+    for name, table, index, statements in checks:
+        if not statements:
+            print(f"FAILED {name}: no statement on {table} was recorded", file=sys.stderr)
+            failures += 1
+        for statement, parameters in statements:
+            plan = query_plan(engine, statement, parameters)
+            is_using_index = any(
+                f"USING INDEX {index}" in line or f"USING COVERING INDEX {index}" in line for line in plan
+            )
+            print(f"{'ok' if is_using_index else 'FAILED'} {name}:", *plan, sep="\n    ")
+            failures += not is_using_index
+
+    print(f"{failures} statements not using their index", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
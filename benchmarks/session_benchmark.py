@@ -0,0 +1,92 @@
+"""
+Measures how many db sessions per second utils.db_utils can hand out, each running the one row query that
+WorkspaceLookup runs, compared with building a sessionmaker on every call like get_session() used to and with opening a
+new connection for every session.
+
+    python benchmarks/session_benchmark.py --sessions 20000
+"""
+
+import argparse
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+from benchmark_utils import create_db, use_temporary_app_dir
+
+
+def sessions_per_second(get_session, session_count: int) -> float:
+    from models.db_tables import CurrentWorkspace
+
+    started_at = time.perf_counter()
+    for _ in range(session_count):
+        with get_session(is_read_only=True) as session:
+            session.query(CurrentWorkspace).first()
+    return round(session_count / (time.perf_counter() - started_at), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark creating db sessions.")
+    parser.add_argument("--sessions", type=int, default=20000, help="sessions per case")
+    args = parser.parse_args()
+
+    use_temporary_app_dir()
+    create_db()
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import NullPool
+
+    from models.db_tables import engine
+    from utils.db_utils import get_scoped_session, get_session, remove_scoped_session
+
+    @contextmanager
+    def get_session_with_new_sessionmaker(is_read_only=False):
+        """get_session() as it was before the session factory was built once at module level"""
+        session = sessionmaker(bind=engine)()
+        try:
+            yield session
+            if not is_read_only:
+                session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @contextmanager
+    def get_removed_scoped_session(is_read_only=False):
+        """get_scoped_session() cleaned up after every use like the other cases, rather than kept for the thread"""
+        try:
+            with get_scoped_session(is_read_only) as session:
+                yield session
+        finally:
+            remove_scoped_session()
+
+    unpooled_session_factory = sessionmaker(bind=create_engine(engine.url, poolclass=NullPool))
+
+    @contextmanager
+    def get_unpooled_session(is_read_only=False):
+        session = unpooled_session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    cases = {
+        "sessionmaker_per_call": get_session_with_new_sessionmaker,
+        "module_level_factory": get_session,
+        "scoped_session": get_removed_scoped_session,
+        "module_level_factory_without_pool": get_unpooled_session,
+    }
+    results = {}
+    for name, get_session_function in cases.items():
+        print(f"Benchmarking {name}", file=sys.stderr)
+        sessions_per_second(get_session_function, min(args.sessions, 1000))  # warm up
+        results[name] = sessions_per_second(get_session_function, args.sessions)
+
+    print(json.dumps({"sessions": args.sessions, "sessions_per_second": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares with tracemalloc the memory taken by the rows TaskListModel loads from the db, TaskRow dataclasses with
+__slots__ built from only the needed columns, against the six key dicts built from Task ORM objects the model used to
+hold. Reports the bytes and blocks still allocated for the loaded rows and the peak while loading them.
+
+    python benchmarks/task_rows_memory_benchmark.py --tasks 50000
+"""
+
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+from benchmark_utils import add_tasks, create_db, use_temporary_app_dir
+
+
+def load_dict_rows(task_type, workspace_id) -> list[dict]:
+    """TaskListModel.load_data() as it was before TaskRow"""
+    from qfluentwidgets import FluentIcon
+
+    from models.db_tables import Task, TaskType
+    from utils.db_utils import get_session
+
+    with get_session(is_read_only=True) as session:
+        return [
+            {
+                "id": task.id,
+                "task_name": task.task_name,
+                "task_position": task.task_position,
+                "elapsed_time": task.elapsed_time,
+                "target_time": task.target_time,
+                "icon": FluentIcon.PLAY if task_type == TaskType.TODO else FluentIcon.MENU,
+            }
+            for task in session.query(Task)
+            .filter(Task.task_type == task_type)
+            .filter(Task.workspace_id == workspace_id)
+            .order_by(Task.task_position)
+            .all()
+        ]
+
+
+def measure(load) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    rows = load()
+    gc.collect()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    differences = after.compare_to(before, "filename")
+    result = {
+        "rows": len(rows),
+        "retained_bytes": sum(difference.size_diff for difference in differences),
+        "retained_blocks": sum(difference.count_diff for difference in differences),
+        "peak_bytes": peak,
+    }
+    del rows
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory of the rows loaded by TaskListModel.")
+    parser.add_argument("--tasks", type=int, default=50000, help="tasks in the workspace")
+    args = parser.parse_args()
+
+    use_temporary_app_dir()
+    create_db()
+    add_tasks(args.tasks)
+
+    from PySide6.QtCore import QCoreApplication
+
+    from models.db_tables import TaskType
+    from models.task_list_model import TaskListModel
+    from models.workspace_lookup import WorkspaceLookup
+
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    workspace_id = WorkspaceLookup.get_current_workspace_id()
+    model = TaskListModel(TaskType.TODO)
+
+    results = {}
+    for name, load in {
+        "dict_rows": lambda: load_dict_rows(TaskType.TODO, workspace_id),
+        "task_rows": lambda: model.query_tasks(workspace_id)[0],
+    }.items():
+        print(f"Measuring {name}", file=sys.stderr)
+        load()  # warm up, so that caches of SQLAlchemy aren't counted
+        results[name] = measure(load)
+
+    print(json.dumps({"tasks": args.tasks, "memory": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Crash consistency test of TaskWriteQueue. A child process writes generations of elapsed times for a set of tasks
+through the queue and is killed at a random point, usually in the middle of a flush. After every kill the db has to
+pass an integrity check, hold one and the same generation for every task of the batch and never go back to an older
+generation. Also checks that a batch containing an update of a task which has been deleted meanwhile is still written.
+
+    python benchmarks/task_write_queue_crash_test.py --kills 20
+
+Exits with a non zero return code if any check fails.
+"""
+
+import argparse
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmark_utils import add_tasks, create_db, use_temporary_app_dir
+
+# printed by the writer once its first batch is committed, stdout also carries whatever imported libraries print
+READY_SENTINEL = "task-write-queue-crash-test: first batch written"
+
+
+def run_writer(app_dir: str):
+    """Child process, writes increasing generations of every task until it gets killed"""
+    use_temporary_app_dir(app_dir)
+    from models.db_tables import Task
+    from models.task_write_queue import task_write_queue
+    from utils.db_utils import get_session
+
+    with get_session(is_read_only=True) as session:
+        task_ids = [task_id for (task_id,) in session.query(Task.id)]
+        generation = max(elapsed_time for (elapsed_time,) in session.query(Task.elapsed_time))
+
+    # queue isn't started, so every batch is flushed right away from this thread
+    task_write_queue.enqueue([{"id": task_id, "elapsed_time": generation + 1} for task_id in task_ids])
+    print(READY_SENTINEL, flush=True)
+    while True:
+        generation += 1
+        task_write_queue.enqueue([{"id": task_id, "elapsed_time": generation + 1} for task_id in task_ids])
+
+
+def read_generations(db_path: str) -> tuple[str, set[int]]:
+    connection = sqlite3.connect(db_path)
+    try:
+        (integrity,) = connection.execute("PRAGMA integrity_check").fetchone()
+        rows = connection.execute("SELECT elapsed_time FROM tasks")
+        return integrity, {elapsed_time for (elapsed_time,) in rows}
+    finally:
+        connection.close()
+
+
+def check_kills(app_dir: str, db_path: str, kills: int) -> list[str]:
+    failures = []
+    last_generation = 0
+    for kill in range(kills):
+        process = subprocess.Popen([sys.executable, __file__, "--writer", app_dir], stdout=subprocess.PIPE, text=True)
+        for line in process.stdout:  # wait until it has written at least once
+            if line.strip() == READY_SENTINEL:
+                break
+        else:
+            failures.append(f"kill {kill}: writer exited with {process.wait()} before writing a batch")
+            continue
+        time.sleep(random.uniform(0, 0.5))
+        process.kill()
+        process.wait()
+
+        integrity, generations = read_generations(db_path)
+        if integrity != "ok":
+            failures.append(f"kill {kill}: integrity check failed: {integrity}")
+        if len(generations) != 1:
+            failures.append(f"kill {kill}: batch was written partially, found generations {sorted(generations)}")
+        elif (generation := generations.pop()) == 0:
+            failures.append(f"kill {kill}: killed before the first batch was written, nothing was checked")
+        elif generation < last_generation:
+            failures.append(f"kill {kill}: generation went back from {last_generation} to {generation}")
+        else:
+            last_generation = generation
+        print(f"kill {kill}: generation {last_generation}", file=sys.stderr)
+    return failures
+
+
+def check_deleted_task(task_ids: list[int]) -> list[str]:
+    """Batch holding updates of a deleted task and of a remaining one, the remaining one has to be written"""
+    from PySide6.QtCore import QCoreApplication
+
+    from models.db_tables import Task
+    from models.task_write_queue import task_write_queue
+    from utils.db_utils import get_session
+
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    deleted_task_id, remaining_task_id = task_ids[:2]
+
+    task_write_queue.start()
+    task_write_queue.enqueue([{"id": deleted_task_id, "elapsed_time": -1}])
+    with get_session() as session:
+        session.query(Task).filter(Task.id == deleted_task_id).delete()
+    task_write_queue.enqueue([{"id": remaining_task_id, "elapsed_time": -2}])
+    task_write_queue.stop()
+
+    with get_session(is_read_only=True) as session:
+        elapsed_time = session.get(Task, remaining_task_id).elapsed_time
+    if elapsed_time != -2 or task_write_queue._pending:
+        return [f"update of a remaining task wasn't written next to one of a deleted task, found {elapsed_time}"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kill the task write queue mid batch and check the db afterwards.")
+    parser.add_argument("--kills", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=2000, help="tasks updated in every batch")
+    parser.add_argument("--writer", metavar="APP_DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.writer:
+        run_writer(args.writer)
+        return
+
+    app_dir = use_temporary_app_dir()
+    from config_paths import db_path
+
+    create_db()
+    task_ids = add_tasks(args.tasks)
+
+    failures = check_kills(app_dir, db_path, args.kills) + check_deleted_task(task_ids)
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    print(f"{args.kills} kills, {len(failures)} failures", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures the cost of a timer tick in workspaces with many tasks. Every tick runs what MainWindow.updateTaskTime() runs
+on the todo list model: looks up the index of the current task, reads its elapsed time and writes the new one back
+through setData(update_db=True), with the write-behind queue started like in the app. The current task is the last one
+of the list, the worst case for a linear scan, which the benchmark also runs for comparison with the id to row index.
+
+    python benchmarks/tick_cost_benchmark.py --task-counts 1000 10000 --ticks 3000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from benchmark_utils import add_tasks, create_db, use_temporary_app_dir
+
+
+def current_task_index_by_scan(model):
+    """TaskListModel.currentTaskIndex() as it was before the id to row index"""
+    for row, task in enumerate(model.tasks):
+        if task.id == model.current_task_id:
+            return model.index(row, 0)
+    return None
+
+
+def microseconds_per_tick(model, current_task_index, tick_count: int) -> float:
+    from models.task_list_model import TaskListModel
+
+    started_at = time.perf_counter()
+    for _ in range(tick_count):
+        final_elapsed_time = model.data(current_task_index(), TaskListModel.ElapsedTimeRole) + 1000
+        model.setData(current_task_index(), final_elapsed_time, TaskListModel.ElapsedTimeRole, update_db=True)
+    return round((time.perf_counter() - started_at) / tick_count * 1_000_000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cost of a timer tick in large workspaces.")
+    parser.add_argument("--task-counts", type=int, nargs="+", default=[1000, 10000], help="todo tasks per workspace")
+    parser.add_argument("--ticks", type=int, default=3000, help="ticks per case")
+    args = parser.parse_args()
+
+    use_temporary_app_dir()
+    create_db()
+
+    from PySide6.QtCore import QCoreApplication
+
+    from models.db_tables import Task, TaskType
+    from models.task_list_model import TaskListModel
+    from models.task_write_queue import task_write_queue
+    from utils.db_utils import get_session
+
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    task_write_queue.start()
+
+    results = {}
+    for task_count in args.task_counts:
+        print(f"Benchmarking {task_count} tasks", file=sys.stderr)
+        with get_session() as session:
+            session.query(Task).delete()
+        add_tasks(task_count)
+
+        model = TaskListModel(TaskType.TODO)
+        model.setCurrentTaskID(model.data(model.index(task_count - 1), TaskListModel.IDRole))
+        results[task_count] = {
+            "id_to_row_index": microseconds_per_tick(model, model.currentTaskIndex, args.ticks),
+            "linear_scan": microseconds_per_tick(model, lambda: current_task_index_by_scan(model), args.ticks),
+        }
+
+    task_write_queue.stop()
+    print(json.dumps({"ticks": args.ticks, "microseconds_per_tick": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
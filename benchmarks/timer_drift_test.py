@@ -0,0 +1,133 @@
+"""
+Drift test of PomodoroTimer. Runs a duration on a virtual monotonic clock and delivers every timeout of the timer late,
+by a random delay and now and then by a stall of several seconds like a busy event loop would, once with the display
+needed and once without it, pausing halfway between two timeouts. Checks that the duration ends exactly when it should
+have, at the first timeout on or after its end, and that the elapsed times of the ticks and of the final tick on pause,
+which the current task is credited with, add up to the duration exactly.
+
+    python benchmarks/timer_drift_test.py --duration 25 --max-delay 400
+
+Also reports how far a timer decrementing a fixed timer_resolution per timeout would have drifted. Exits with a non
+zero return code if any check fails.
+"""
+
+import argparse
+import random
+import sys
+
+from benchmark_utils import use_temporary_app_dir
+
+
+class VirtualClock:
+    """Stands in for the time module in models.timer, time only moves when advance() is called"""
+
+    def __init__(self):
+        self.now_ns = 1_000_000_000_000
+
+    def monotonic_ns(self) -> int:
+        return self.now_ns
+
+    def advance(self, ms: int):
+        self.now_ns += ms * 1_000_000
+
+
+def run_duration(pomodoro_timer, clock: VirtualClock, args, display_needed: bool) -> list[str]:
+    name = "display needed" if display_needed else "display not needed"
+    duration_ms = args.duration * 60 * 1000
+    pause_ms = 90_000
+    failures = []
+
+    pomodoro_timer.setDisplayNeeded(display_needed)
+    pomodoro_timer.setTimerDuration(duration_ms)
+    started_at_ns = clock.now_ns
+    pomodoro_timer.startDuration()
+    expected_end_ns = started_at_ns + (duration_ms + pause_ms) * 1_000_000
+
+    ticks = 0
+    injected_delay_ms = 0
+    credited_ms = 0
+    final_tick_ms = []
+    is_paused = False
+
+    def on_final_tick():
+        final_tick_ms.append(pomodoro_timer.getTickElapsedTime())
+
+    pomodoro_timer.finalTickSignal.connect(on_final_tick)
+    while pomodoro_timer.pomodoro_timer.isActive():
+        delay_ms = random.randint(0, args.max_delay)
+        if ticks and ticks % args.stall_every == 0:
+            delay_ms += args.stall
+        clock.advance(pomodoro_timer.pomodoro_timer.interval() + delay_ms)  # timeout is delivered late
+        injected_delay_ms += delay_ms
+        ticks += 1
+
+        pomodoro_timer.pomodoro_timer.stop()
+        pomodoro_timer.updateRemainingTime()
+        credited_ms += pomodoro_timer.getTickElapsedTime()
+        if pomodoro_timer.remaining_time_ns == 0:
+            if clock.now_ns < expected_end_ns:
+                failures.append(f"{name}: ended {(expected_end_ns - clock.now_ns) / 1e6} ms early")
+            elif clock.now_ns - expected_end_ns > delay_ms * 1_000_000:
+                late_ms = (clock.now_ns - expected_end_ns) / 1e6
+                failures.append(f"{name}: ended {late_ms} ms late, more than its last timeout was delayed")
+            break
+        if not is_paused and pomodoro_timer.getRemainingTime() <= duration_ms // 2:
+            is_paused = True
+            # paused most of the way to the next timeout, which can be seconds away while display isn't needed
+            clock.advance(pomodoro_timer.pomodoro_timer.interval() * 9 // 10)
+            pomodoro_timer.pauseDuration()
+            clock.advance(pause_ms)
+            pomodoro_timer.setDuration()  # resumes
+
+    if pomodoro_timer.remaining_time_ns != 0:
+        failures.append(f"{name}: timer stopped ticking with {pomodoro_timer.getRemainingTime()} ms remaining")
+    credited_ms += sum(final_tick_ms)
+    if credited_ms != duration_ms:
+        failures.append(f"{name}: ticks credited {credited_ms} ms for a duration of {duration_ms} ms")
+
+    # a timer decrementing timer_resolution per timeout needs a timeout for every second of the duration and ends late
+    # by the delays of all of them
+    decrementing_drift_ms = injected_delay_ms * (duration_ms // pomodoro_timer.timer_resolution) // ticks
+    print(
+        f"{name}: {ticks} ticks, {injected_delay_ms} ms of delays injected, {sum(final_tick_ms)} ms credited on pause, "
+        f"ended "
+        f"{(clock.now_ns - expected_end_ns) / 1e6} ms after the deadline, a decrementing timer would have drifted by "
+        f"about {decrementing_drift_ms} ms",
+        file=sys.stderr,
+    )
+    pomodoro_timer.stopSession()
+    pomodoro_timer.finalTickSignal.disconnect(on_final_tick)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver the timeouts of PomodoroTimer late and check it for drift.")
+    parser.add_argument("--duration", type=int, default=25, help="duration in minutes")
+    parser.add_argument("--max-delay", type=int, default=400, help="maximum delay of a timeout in ms")
+    parser.add_argument("--stall-every", type=int, default=50, help="ticks between stalls of the event loop")
+    parser.add_argument("--stall", type=int, default=5000, help="length of a stall in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    use_temporary_app_dir()
+
+    from PySide6.QtCore import QCoreApplication
+
+    import models.timer
+    from models.timer import PomodoroTimer
+
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    clock = VirtualClock()
+    models.timer.time = clock
+    pomodoro_timer = PomodoroTimer()
+
+    failures = run_duration(pomodoro_timer, clock, args, display_needed=True)
+    failures += run_duration(pomodoro_timer, clock, args, display_needed=False)
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Replays the db writes of an hour long work session, one TaskListModel.setData(update_db=True) call for the elapsed time
+of the current task per timer tick, and reports how long the calls take under different PRAGMA profiles: the rollback
+journal sqlite defaults to, the WAL profile of the app writing synchronously, and the WAL profile with writes going
+through the write-behind TaskWriteQueue like in the app.
+
+    python benchmarks/write_latency_benchmark.py --ticks 3600
+
+Ticks are replayed back to back instead of a second apart, so the queue coalesces more ticks per flush than it would
+in the app. Its numbers are the latency on the calling thread, which is what the timer waits on.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from benchmark_utils import add_tasks, create_db, use_temporary_app_dir
+
+ROLLBACK_JOURNAL_PROFILE = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "cache_size": -2000,
+    "mmap_size": 0,
+    "temp_store": "DEFAULT",
+    "busy_timeout": 5000,
+}
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def replay_work_session(tick_count: int) -> dict:
+    from models.db_tables import TaskType
+    from models.task_list_model import TaskListModel
+
+    model = TaskListModel(TaskType.TODO)
+    index = model.index(0)
+    model.setCurrentTaskID(model.data(index, TaskListModel.IDRole))
+
+    latencies = []
+    started_at = time.perf_counter()
+    for _ in range(tick_count):
+        elapsed_time = model.data(index, TaskListModel.ElapsedTimeRole) + 1000
+        tick_started_at = time.perf_counter()
+        model.setData(index, elapsed_time, TaskListModel.ElapsedTimeRole, update_db=True)
+        latencies.append(time.perf_counter() - tick_started_at)
+    duration = time.perf_counter() - started_at
+
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "total_seconds": round(duration, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark db write latency of a replayed work session.")
+    parser.add_argument("--ticks", type=int, default=3600, help="timer ticks to replay, one per second of work")
+    args = parser.parse_args()
+
+    use_temporary_app_dir()
+    create_db()
+    add_tasks(100)
+
+    from PySide6.QtCore import QCoreApplication
+
+    from models.db_tables import configure_sqlite_pragmas, sqlite_pragmas
+    from models.task_write_queue import task_write_queue
+
+    app = QCoreApplication.instance() or QCoreApplication([])  # noqa: F841
+    wal_profile = dict(sqlite_pragmas)
+
+    results = {}
+    print("Replaying with the rollback journal", file=sys.stderr)
+    configure_sqlite_pragmas(ROLLBACK_JOURNAL_PROFILE)
+    results["rollback_journal"] = replay_work_session(args.ticks)
+
+    print("Replaying with WAL", file=sys.stderr)
+    configure_sqlite_pragmas(wal_profile)
+    results["wal"] = replay_work_session(args.ticks)
+
+    print("Replaying with WAL and the write-behind queue", file=sys.stderr)
+    task_write_queue.start()
+    results["wal_write_behind"] = replay_work_session(args.ticks)
+    task_write_queue.stop()
+
+    print(
+        json.dumps(
+            {"ticks": args.ticks, "wal_profile": wal_profile, "setdata_latency": results},
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,6 @@ root, _ = os.path.splitext(setting_temp.fileName())
 settings_file_path = root + ".json"
 
 db_path = os.path.join(settings_dir, f"{APPLICATION_NAME}.db")
+
+# compiled rule files of the website filter, read by mitmdump
+filter_rules_dir = os.path.join(settings_dir, "filter_rules")
@@ -10,6 +10,8 @@ class ConfigValues:
     AUTOSTART_BREAK = workspace_specific_settings.get(workspace_specific_settings.autostart_break)
     ENABLE_WEBSITE_FILTER = workspace_specific_settings.get(workspace_specific_settings.enable_website_filter)
     PROXY_PORT = app_settings.get(app_settings.proxy_port)
+    PROXY_ROUTING_MODE = app_settings.get(app_settings.proxy_routing_mode)
+    PROXY_ENGINE = app_settings.get(app_settings.proxy_engine)
     CHECK_FOR_UPDATES_ON_START = app_settings.get(app_settings.check_for_updates_on_start)
     HAS_COMPLETED_TASK_VIEW_TUTORIAL = app_settings.get(app_settings.has_completed_task_view_tutorial)
     HAS_COMPLETED_POMODORO_VIEW_TUTORIAL = app_settings.get(app_settings.has_completed_pomodoro_view_tutorial)
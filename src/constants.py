@@ -19,25 +19,17 @@ ENABLE_WEBSITE_FILTER = True
 # for dotfile to detect if its the first time the app is run
 FIRST_RUN_DOTFILE_NAME = ".first_run"
 
-MITMDUMP_COMMAND_LINUX = (
-    '{} --set allow_remote=true -p {} --showhost -s {} --set "addresses_str={}" --set "block_type={}"'.format(
-        "{}",
-        "{}",
-        os.path.join(getattr(sys, "_MEIPASS", Path(__file__).parent), "website_blocker", "filter.py"),
-        "{}",
-        "{}",
-    )
+MITMDUMP_COMMAND_LINUX = "{} --set allow_remote=true -p {} --showhost -s {}".format(
+    "{}",
+    "{}",
+    os.path.join(getattr(sys, "_MEIPASS", Path(__file__).parent), "website_blocker", "filter.py"),
 )  # using _MEIPASS to make it compatible with pyinstaller
 # the os.path.join returns the location of filter.py
 
-MITMDUMP_COMMAND_WINDOWS = (
-    r"{} --set allow_remote=true -p {} --showhost -s {} --set addresses_str={} --set block_type={}".format(
-        "{}",
-        "{}",
-        os.path.join(getattr(sys, "_MEIPASS", Path(__file__).parent), "website_blocker", "filter.py"),
-        "{}",
-        "{}",
-    )
+MITMDUMP_COMMAND_WINDOWS = r"{} --set allow_remote=true -p {} --showhost -s {}".format(
+    "{}",
+    "{}",
+    os.path.join(getattr(sys, "_MEIPASS", Path(__file__).parent), "website_blocker", "filter.py"),
 )  # using _MEIPASS to make it compatible with pyinstaller
 # the os.path.join returns the location of filter.py
 
@@ -46,6 +38,8 @@ BLOCK_HTML_MESSAGE = f"<h1>Website blocked by {APPLICATION_NAME}!</h1>"
 UPDATE_CHECK_URL = "https://raw.githubusercontent.com/kun-codes/koncentro/refs/heads/main/pyproject.toml"
 NEW_RELEASE_URL = "https://github.com/kun-codes/koncentro/releases/latest"
 MITMDUMP_SHUTDOWN_URL = f"http://shutdown.{APPLICATION_NAME.lower()}.internal/"
+MITMDUMP_STATS_URL = f"http://stats.{APPLICATION_NAME.lower()}.internal/"
+MITMDUMP_CONTROL_URL = f"http://control.{APPLICATION_NAME.lower()}.internal/"
 
 
 class WebsiteFilterType(Enum):
@@ -60,6 +54,39 @@ class URLListType(Enum):
     ALLOWLIST_EXCEPTION = "allowlist_exception_urls"
 
 
+class MitmdumpState(Enum):
+    """
+    Tells what state mitmdump is in, as seen by the supervisor of WebsiteBlockerManager
+    """
+
+    STOPPED = "Stopped"
+    STARTING = "Starting"
+    HEALTHY = "Healthy"
+    STOPPING = "Stopping"
+
+
+class ProxyRoutingMode(Enum):
+    """
+    Tells how traffic is routed to mitmdump while filtering: all of it through the system proxy, or only the hosts
+    which rules can apply to through a proxy auto-config script
+    """
+
+    SYSTEM_PROXY = "SystemProxy"
+    PAC = "PAC"
+
+
+class ProxyEngine(Enum):
+    """
+    Tells what filters the traffic: mitmdump, which intercepts TLS and can block on full URLs, the asyncio proxy of
+    the app, which only tunnels HTTPS and so blocks HTTPS on hosts, or the DNS sinkhole of the app, which blocks on
+    hosts by not resolving them
+    """
+
+    MITMDUMP = "Mitmdump"
+    ASYNCIO = "Asyncio"
+    DNS_SINKHOLE = "DnsSinkhole"
+
+
 class TimerState(Enum):
     """
     Tells what state the timer is in
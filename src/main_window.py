@@ -3,7 +3,7 @@ from pathlib import Path
 
 import darkdetect
 from loguru import logger
-from PySide6.QtCore import Qt
+from PySide6.QtCore import QEvent, Qt
 from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QMenu, QSystemTrayIcon, QApplication
 from qfluentwidgets import (
@@ -30,6 +30,7 @@ from constants import (
 from models.config import app_settings, load_workspace_settings, workspace_specific_settings
 from models.db_tables import TaskType
 from models.task_list_model import TaskListModel
+from models.task_write_queue import task_write_queue
 from models.workspace_list_model import WorkspaceListModel
 from prefabs.customFluentIcon import CustomFluentIcon
 from prefabs.koncentroFluentWindow import KoncentroFluentWindow
@@ -49,6 +50,7 @@ from views.subinterfaces.pomodoro_view import PomodoroView
 from views.subinterfaces.settings_view import SettingsView
 from views.subinterfaces.tasks_view import TaskListView
 from views.subinterfaces.website_blocker_view import WebsiteBlockerView
+from website_blocker.rule_compiler import CompiledRules
 from website_blocker.website_blocker_manager import WebsiteBlockerManager
 
 
@@ -86,6 +88,13 @@ class MainWindow(KoncentroFluentWindow):
         self.manage_workspace_dialog = None
 
         self.website_blocker_manager = WebsiteBlockerManager()
+        if ConfigValues.ENABLE_WEBSITE_FILTER and not self.is_first_run:
+            # mitmdump takes seconds to start, so it is started in standby now instead of when work session begins
+            self.website_blocker_manager.prewarm(
+                ConfigValues.PROXY_PORT, get_mitmdump_path(), ConfigValues.PROXY_ENGINE
+            )
+
+        task_write_queue.start()  # task updates are written to db from a worker thread from now on
 
         self.themeListener = SystemThemeListener(self)
         self.themeListener.start()
@@ -196,6 +205,10 @@ class MainWindow(KoncentroFluentWindow):
         self.tray_menu_quit_action.triggered.connect(self.quitApplication)
 
         self.tray.setContextMenu(self.tray_menu)
+        # timer status action shows the remaining time, so the timer has to tick every second while the menu is open
+        self.tray_menu_shown = False
+        self.tray_menu.aboutToShow.connect(lambda: self.onTrayMenuShownChanged(True))
+        self.tray_menu.aboutToHide.connect(lambda: self.onTrayMenuShownChanged(False))
 
         self.tray_white_icon = QIcon(":/logosPrefix/logos/logo-monochrome-white.svg")
         self.tray_black_icon = QIcon(":/logosPrefix/logos/logo-monochrome-black.svg")
@@ -337,42 +350,47 @@ class MainWindow(KoncentroFluentWindow):
             self.settings_interface.pomodoro_settings_group.setDisabled(True)
             workspace_selector_button.setDisabled(True)
             self.settings_interface.proxy_port_card.setDisabled(True)
+            self.settings_interface.proxy_routing_mode_card.setDisabled(True)
+            self.settings_interface.proxy_engine_card.setDisabled(True)
             self.pomodoro_interface.skipButton.setEnabled(True)
             self.bottomBar.skipButton.setEnabled(True)
         else:
             self.settings_interface.pomodoro_settings_group.setDisabled(False)
             workspace_selector_button.setDisabled(False)
             self.settings_interface.proxy_port_card.setDisabled(False)
+            self.settings_interface.proxy_routing_mode_card.setDisabled(False)
+            self.settings_interface.proxy_engine_card.setDisabled(False)
             self.pomodoro_interface.skipButton.setEnabled(False)
             self.bottomBar.skipButton.setEnabled(False)
 
     def toggle_website_filtering(self, timerState):
         if not ConfigValues.ENABLE_WEBSITE_FILTER:
-            logger.debug("Website filtering is disabled, so not starting website filtering")
-            self.website_blocker_manager.stop_filtering(delete_proxy=True)
+            logger.debug("Website filtering is disabled, so shutting website filtering down")
+            # no standby mitmdump is kept while the filter is disabled in the current workspace, it is started again
+            # once the filter is enabled
+            self.website_blocker_manager.shutdown_filtering()
             return
 
         logger.debug("Website filtering is enabled, so starting website filtering")
         website_filter_type = self.website_filter_interface.model.get_website_filter_type()
         logger.debug(f"website_filter_type: {website_filter_type}")
 
-        urls = None
+        rules = CompiledRules()
+        exception_rules = CompiledRules()
         block_type = None
-        joined_urls = ""
 
         if website_filter_type == WebsiteFilterType.BLOCKLIST:  # blocklist
-            urls = self.website_filter_interface.model.get_urls(URLListType.BLOCKLIST)
+            rules = self.website_filter_interface.model.get_compiled_rules(URLListType.BLOCKLIST)
+            exception_rules = self.website_filter_interface.model.get_compiled_rules(URLListType.BLOCKLIST_EXCEPTION)
             block_type = "blocklist"
         elif website_filter_type == WebsiteFilterType.ALLOWLIST:  # allowlist
-            urls = self.website_filter_interface.model.get_urls(URLListType.ALLOWLIST)
+            rules = self.website_filter_interface.model.get_compiled_rules(URLListType.ALLOWLIST)
+            exception_rules = self.website_filter_interface.model.get_compiled_rules(URLListType.ALLOWLIST_EXCEPTION)
             block_type = "allowlist"
 
-        logger.debug(f"URLs: {urls}")
+        logger.debug(f"Number of rules: {len(rules)}, number of exceptions: {len(exception_rules)}")
         logger.debug(f"Block type: {block_type}")
 
-        if urls is not None:  # find what to do when there are no urls registered
-            joined_urls = ",".join(urls)
-
         mitmdump_path = get_mitmdump_path()
 
         if timerState == TimerState.WORK:
@@ -380,11 +398,20 @@ class MainWindow(KoncentroFluentWindow):
             # is off, the website filter would start even when the timer is not running
             logger.debug("Starting website filtering")
             self.website_blocker_manager.start_filtering(
-                ConfigValues.PROXY_PORT, joined_urls, block_type, mitmdump_path
+                ConfigValues.PROXY_PORT,
+                rules,
+                block_type,
+                mitmdump_path,
+                exception_rules,
+                ConfigValues.PROXY_ROUTING_MODE,
+                ConfigValues.PROXY_ENGINE,
             )
         else:
             logger.debug("Stopping website filtering")
             self.website_blocker_manager.stop_filtering(delete_proxy=True)
+            # makes sure mitmdump is warm for the next work session, in case it has exited or the filter has just been
+            # enabled
+            self.website_blocker_manager.prewarm(ConfigValues.PROXY_PORT, mitmdump_path, ConfigValues.PROXY_ENGINE)
 
     def is_task_beginning(self):
         current_state = self.pomodoro_interface.pomodoro_timer_obj.getTimerState()
@@ -495,18 +522,22 @@ class MainWindow(KoncentroFluentWindow):
             if self.pomodoro_interface.pomodoro_timer_obj.getTimerState() in [TimerState.BREAK, TimerState.LONG_BREAK]:
                 return
 
+            # time passed since the previous timeout, can be more than timer_resolution if the timeout was late
+            tick_elapsed_time = self.pomodoro_interface.pomodoro_timer_obj.getTickElapsedTime()
+            if tick_elapsed_time == 0:
+                return
+
             final_elapsed_time = (
                 self.task_interface.todoTasksList.model().data(
                     self.get_current_task_index(), TaskListModel.ElapsedTimeRole
                 )
-                + self.pomodoro_interface.pomodoro_timer_obj.timer_resolution
+                + tick_elapsed_time
             )
             if final_elapsed_time % 1000 == 0:  # only update db when the elapsed time is a multiple of 1000
+                # update is only queued here, task_write_queue coalesces it and writes it to db every few seconds
                 self.task_interface.todoTasksList.model().setData(
-                    self.get_current_task_index(), final_elapsed_time, TaskListModel.ElapsedTimeRole, update_db=False
+                    self.get_current_task_index(), final_elapsed_time, TaskListModel.ElapsedTimeRole, update_db=True
                 )
-            if final_elapsed_time % 5000 == 0:
-                self.updateTaskTimeDB()
 
     def updateTaskTimeDB(self):
         # since sessionStoppedSignal is emitted when the timer is stopped, we have to check if the current task index
@@ -540,11 +571,17 @@ class MainWindow(KoncentroFluentWindow):
             self.bottomBar.pauseResumeButton
         ))
         self.pomodoro_interface.pomodoro_timer_obj.pomodoro_timer.timeout.connect(self.updateTaskTime)
+        self.pomodoro_interface.pomodoro_timer_obj.finalTickSignal.connect(self.updateTaskTime)
         self.task_interface.completedTasksList.model().taskMovedSignal.connect(self.check_current_task_moved)
         self.pomodoro_interface.pomodoro_timer_obj.sessionStoppedSignal.connect(self.updateTaskTimeDB)
         self.task_interface.todoTasksList.model().taskDeletedSignal.connect(self.check_current_task_deleted)
         self.pomodoro_interface.pomodoro_timer_obj.durationSkippedSignal.connect(self.updateTaskTimeDB)
         self.pomodoro_interface.pomodoro_timer_obj.sessionPausedSignal.connect(self.updateTaskTimeDB)
+        # write queued task updates right away when the timer isn't running anymore. Connected after updateTaskTimeDB
+        # so that the latest elapsed time is already queued
+        self.pomodoro_interface.pomodoro_timer_obj.sessionStoppedSignal.connect(task_write_queue.requestFlush)
+        self.pomodoro_interface.pomodoro_timer_obj.durationSkippedSignal.connect(task_write_queue.requestFlush)
+        self.pomodoro_interface.pomodoro_timer_obj.sessionPausedSignal.connect(task_write_queue.requestFlush)
         self.website_filter_interface.blockTypeComboBox.currentIndexChanged.connect(
             lambda: self.toggle_website_filtering(self.pomodoro_interface.pomodoro_timer_obj.getTimerState())
         )
@@ -568,6 +605,8 @@ class MainWindow(KoncentroFluentWindow):
         )
         self.stackedWidget.mousePressEvent = self.onStackedWidgetClicked
         self.settings_interface.proxy_port_card.valueChanged.connect(self.update_proxy_port)
+        self.website_blocker_manager.operationWarning.connect(self.showWebsiteFilterWarning)
+        self.website_blocker_manager.operationError.connect(self.showWebsiteFilterError)
 
         self.task_interface.todoTasksList.model().currentTaskChangedSignal.connect(
             lambda task_id: self.bottomBar.taskLabel.setText(
@@ -688,6 +727,28 @@ class MainWindow(KoncentroFluentWindow):
     def update_proxy_port(self):
         self.website_blocker_manager.proxy.port = ConfigValues.PROXY_PORT
 
+    def showWebsiteFilterWarning(self, message: str):
+        InfoBar.warning(
+            title="Website Filter",
+            content=message,
+            orient=Qt.Orientation.Vertical,
+            isClosable=True,
+            position=InfoBarPosition.TOP_RIGHT,
+            duration=10000,
+            parent=self,
+        )
+
+    def showWebsiteFilterError(self, message: str):
+        InfoBar.error(
+            title="Website Filter",
+            content=message,
+            orient=Qt.Orientation.Vertical,
+            isClosable=True,
+            position=InfoBarPosition.TOP_RIGHT,
+            duration=10000,
+            parent=self,
+        )
+
 
     def update_bottom_bar_timer_label(self):
         # check if timer is running
@@ -804,6 +865,7 @@ class MainWindow(KoncentroFluentWindow):
     def showEvent(self, event):
         logger.debug("MainWindow showEvent")
         super().showEvent(event)
+        self.updateTimerDisplayNeeded()
 
         if not self.initial_launch:
             return
@@ -814,12 +876,34 @@ class MainWindow(KoncentroFluentWindow):
         elif self.updateDialog is not None:
             self.updateDialog.show()
 
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.updateTimerDisplayNeeded()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.updateTimerDisplayNeeded()
+
+    def onTrayMenuShownChanged(self, shown: bool):
+        self.tray_menu_shown = shown
+        self.updateTimerDisplayNeeded()
+
+    def updateTimerDisplayNeeded(self):
+        """
+        Lets the timer tick every second only when the window or the tray menu is visible
+        """
+        display_needed = (self.isVisible() and not self.isMinimized()) or self.tray_menu_shown
+        self.pomodoro_interface.pomodoro_timer_obj.setDisplayNeeded(display_needed)
+
     def quitApplication(self):
         app_instance = QApplication.instance()
         app_instance.quit()
 
     def closeEvent(self, event):
-        self.website_blocker_manager.stop_filtering(delete_proxy=True)
+        self.updateTaskTimeDB()
+        task_write_queue.stop()  # writes whatever is still queued before quitting
+        self.website_blocker_manager.shutdown_filtering()
         self.website_blocker_manager.cleanup()
         self.themeListener.terminate()
         self.themeListener.deleteLater()
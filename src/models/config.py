@@ -1,4 +1,15 @@
-from qfluentwidgets import BoolValidator, ConfigItem, QConfig, RangeConfigItem, RangeValidator, Theme, qconfig
+from qfluentwidgets import (
+    BoolValidator,
+    ConfigItem,
+    EnumSerializer,
+    OptionsConfigItem,
+    OptionsValidator,
+    QConfig,
+    RangeConfigItem,
+    RangeValidator,
+    Theme,
+    qconfig,
+)
 
 from config_paths import settings_file_path
 from constants import (
@@ -9,8 +20,10 @@ from constants import (
     LONG_BREAK_DURATION,
     WORK_DURATION,
     WORK_INTERVALS,
+    ProxyEngine,
+    ProxyRoutingMode,
 )
-from models.db_tables import Workspace
+from models.db_tables import Workspace, configure_sqlite_pragmas
 from prefabs.config.config_item_sql import ConfigItemSQL, RangeConfigItemSQL
 from prefabs.config.qconfig_sql import QConfigSQL, qconfig_custom
 from utils.detect_windows_version import isWin11
@@ -42,6 +55,16 @@ class AppSettings(QConfig):
     """
 
     proxy_port = RangeConfigItem("AppSettings", "ProxyPort", 8080, RangeValidator(1024, 65535))
+    proxy_routing_mode = OptionsConfigItem(
+        "AppSettings",
+        "ProxyRoutingMode",
+        ProxyRoutingMode.SYSTEM_PROXY,
+        OptionsValidator(ProxyRoutingMode),
+        EnumSerializer(ProxyRoutingMode),
+    )
+    proxy_engine = OptionsConfigItem(
+        "AppSettings", "ProxyEngine", ProxyEngine.MITMDUMP, OptionsValidator(ProxyEngine), EnumSerializer(ProxyEngine)
+    )
     check_for_updates_on_start = ConfigItem("AppSettings", "CheckForUpdatesOnStart", True, BoolValidator())
     has_completed_task_view_tutorial = ConfigItem("AppSettings", "HasCompletedTaskViewTutorial", False, BoolValidator())
     has_completed_pomodoro_view_tutorial = ConfigItem(
@@ -55,6 +78,20 @@ class AppSettings(QConfig):
     )
     mica_enabled = ConfigItem("MainWindow", "MicaEnabled", isWin11(), BoolValidator())
 
+    # PRAGMAs for the sqlite database, applied on every new connection
+    db_journal_mode = OptionsConfigItem(
+        "Database", "JournalMode", "WAL", OptionsValidator(["WAL", "DELETE", "TRUNCATE", "PERSIST"])
+    )
+    db_synchronous = OptionsConfigItem("Database", "Synchronous", "NORMAL", OptionsValidator(["OFF", "NORMAL", "FULL"]))
+    db_cache_size = RangeConfigItem("Database", "CacheSizeKiB", 8192, RangeValidator(0, 1048576))
+    db_mmap_size = RangeConfigItem("Database", "MmapSizeMiB", 64, RangeValidator(0, 1024))
+    db_temp_store = OptionsConfigItem(
+        "Database", "TempStore", "MEMORY", OptionsValidator(["DEFAULT", "FILE", "MEMORY"])
+    )
+    db_busy_timeout = RangeConfigItem("Database", "BusyTimeout", 5000, RangeValidator(0, 60000))
+    # interval in ms after which queued task updates are written to the database
+    task_write_interval = RangeConfigItem("Database", "TaskWriteInterval", 5000, RangeValidator(500, 60000))
+
 
 workspace_specific_settings = WorkspaceSettings()
 app_settings = AppSettings()
@@ -71,5 +108,19 @@ def load_app_settings():
     qconfig.load(settings_file_path, app_settings)
 
 
+def load_db_settings():
+    configure_sqlite_pragmas(
+        {
+            "journal_mode": app_settings.get(app_settings.db_journal_mode),
+            "synchronous": app_settings.get(app_settings.db_synchronous),
+            "cache_size": -app_settings.get(app_settings.db_cache_size),  # negative value means size in KiB
+            "mmap_size": app_settings.get(app_settings.db_mmap_size) * 1024 * 1024,
+            "temp_store": app_settings.get(app_settings.db_temp_store),
+            "busy_timeout": app_settings.get(app_settings.db_busy_timeout),
+        }
+    )
+
+
 load_app_settings()
+load_db_settings()  # before loading workspace settings as they are stored in the database
 load_workspace_settings()
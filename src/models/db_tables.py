@@ -2,9 +2,22 @@ from datetime import datetime, timezone
 from enum import Enum
 from pathlib import Path
 
-from sqlalchemy import URL, Boolean, Column, DateTime, Engine, ForeignKey, Integer, String, create_engine, event
+from sqlalchemy import (
+    URL,
+    Boolean,
+    Column,
+    DateTime,
+    Engine,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    create_engine,
+    event,
+)
 from sqlalchemy import Enum as SQLEnum
 from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.pool import QueuePool
 
 from config_paths import db_path, settings_dir
 from constants import (
@@ -23,7 +36,18 @@ url_object = URL.create(
     "sqlite",
     database=db_path,
 )
-engine = create_engine(url_object)
+# QueuePool keeps connections open between sessions so that they don't have to reconnect to the database every time
+# they are created. A pool which shares one connection per thread (StaticPool, SingletonThreadPool) can't be used since
+# sessions are nested in a lot of places, closing the inner session would roll back the outer one on the shared
+# connection. check_same_thread is disabled since pooled connections get handed out to QThreads too
+# https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#threading-pooling-behavior
+engine = create_engine(
+    url_object,
+    poolclass=QueuePool,
+    pool_size=5,
+    max_overflow=10,
+    connect_args={"check_same_thread": False},
+)
 
 settings_dir = Path(settings_dir)
 # if the settings directory does not exist, create it
@@ -33,12 +57,36 @@ if not settings_dir.exists():
 Base = declarative_base()
 
 
+# PRAGMAs applied to every new connection along with foreign_keys, see https://www.sqlite.org/pragma.html
+# WAL with synchronous=NORMAL makes sqlite skip the fsync on every commit, which matters since the timer commits every
+# few seconds. Values are overwritten by configure_sqlite_pragmas() with the ones stored in AppSettings
+sqlite_pragmas = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -8192,  # negative value means size in KiB instead of number of pages
+    "mmap_size": 64 * 1024 * 1024,  # in bytes
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # in milliseconds
+}
+
+
+def configure_sqlite_pragmas(pragmas: dict):
+    """
+    Updates the PRAGMAs applied on connect and drops already pooled connections so that they get applied to every
+    connection used from now on
+    """
+    sqlite_pragmas.update(pragmas)
+    engine.dispose()
+
+
 # from: https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#foreign-key-support
 # for supporting foreign keys in sqlite as they are disabled by default as per: https://www.sqlite.org/foreignkeys.html
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    for pragma, value in sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
     cursor.close()
 
 
@@ -66,6 +114,10 @@ class Task(Base):
     """
 
     __tablename__ = "tasks"
+    # tasks are always looked up by workspace and task type, ordered by position
+    __table_args__ = (
+        Index("ix_tasks_workspace_id_task_type_task_position", "workspace_id", "task_type", "task_position"),
+    )
 
     id = Column(Integer, primary_key=True)
     workspace_id = Column(Integer, ForeignKey("workspaces.id"))
@@ -122,6 +174,7 @@ class CurrentWorkspace(Base):
 
 class BlocklistURL(Base):
     __tablename__ = URLListType.BLOCKLIST.value
+    __table_args__ = (Index("ix_blocklist_urls_workspace_id_url", "workspace_id", "url"),)
     id = Column(Integer, primary_key=True)
     workspace_id = Column(Integer, ForeignKey("workspaces.id"))
     url = Column(String, nullable=False)
@@ -131,6 +184,7 @@ class BlocklistURL(Base):
 
 class BlocklistExceptionURL(Base):
     __tablename__ = URLListType.BLOCKLIST_EXCEPTION.value
+    __table_args__ = (Index("ix_blocklist_exception_urls_workspace_id_url", "workspace_id", "url"),)
     id = Column(Integer, primary_key=True)
     workspace_id = Column(Integer, ForeignKey("workspaces.id"))
     url = Column(String, nullable=False)
@@ -140,6 +194,7 @@ class BlocklistExceptionURL(Base):
 
 class AllowlistURL(Base):
     __tablename__ = URLListType.ALLOWLIST.value
+    __table_args__ = (Index("ix_allowlist_urls_workspace_id_url", "workspace_id", "url"),)
     id = Column(Integer, primary_key=True)
     workspace_id = Column(Integer, ForeignKey("workspaces.id"))
     url = Column(String, nullable=False)
@@ -149,6 +204,7 @@ class AllowlistURL(Base):
 
 class AllowlistExceptionURL(Base):
     __tablename__ = URLListType.ALLOWLIST_EXCEPTION.value
+    __table_args__ = (Index("ix_allowlist_exception_urls_workspace_id_url", "workspace_id", "url"),)
     id = Column(Integer, primary_key=True)
     workspace_id = Column(Integer, ForeignKey("workspaces.id"))
     url = Column(String, nullable=False)
@@ -1,15 +1,33 @@
+from dataclasses import dataclass
+
 from loguru import logger
 from PySide6.QtCore import QAbstractListModel, QByteArray, QDataStream, QIODevice, QMimeData, QModelIndex, Qt, Signal
 from PySide6.QtGui import QColor
 from qfluentwidgets import FluentIcon
-from sqlalchemy import update
+from sqlalchemy import func, tuple_, update
 
 from models.config import AppSettings
 from models.db_tables import Task, TaskType
+from models.task_write_queue import task_write_queue
 from models.workspace_lookup import WorkspaceLookup
 from utils.db_utils import get_session
 
 
+@dataclass(slots=True)
+class TaskRow:
+    """
+    In memory representation of a task in TaskListModel. Uses __slots__ instead of a dict per task, which matters for
+    workspaces with thousands of tasks
+    """
+
+    id: int
+    task_name: str
+    task_position: int
+    elapsed_time: int  # in ms
+    target_time: int  # in ms
+    icon: FluentIcon
+
+
 class TaskListModel(QAbstractListModel):
     IDRole = Qt.UserRole + 1
     IconRole = Qt.UserRole + 3
@@ -20,11 +38,22 @@ class TaskListModel(QAbstractListModel):
     taskMovedSignal = Signal(int, TaskType)  # task_id and TaskType
     currentTaskChangedSignal = Signal(int)  # task_id
 
+    FETCH_PAGE_SIZE = 100  # number of tasks loaded at a time by a lazily loaded model
+    # positions left free in front of the unloaded tasks whenever they have to be shifted, so that the drops after it
+    # fit in without shifting the whole history of completed tasks again
+    UNLOADED_POSITION_GAP = 1000
+
     def __init__(self, task_type: TaskType, parent=None):
         super().__init__(parent)
         self.task_type = task_type
+        # completed tasks keep on piling up in long-lived workspaces, so they are loaded from db in pages as the view
+        # scrolls using canFetchMore() and fetchMore()
+        self.lazy_loading = task_type == TaskType.COMPLETED
+        self.has_more_tasks = False
         self.current_task_id = None
         self.tasks = []
+        self.task_rows = {}  # task id -> row of the task in self.tasks, kept in sync with self.tasks for O(1) lookups
+        self.dirty_tasks = {}  # task id -> set of columns which have changed in memory but aren't written to db yet
         self.load_data()
 
     def setCurrentTaskID(self, id):
@@ -36,45 +65,141 @@ class TaskListModel(QAbstractListModel):
 
     def load_data(self):
         current_workspace_id = WorkspaceLookup.get_current_workspace_id()
+        task_write_queue.flush()  # make sure that queued updates are in the db before reading from it
         self.tasks = []
+        self.dirty_tasks = {}
+        self.tasks, self.has_more_tasks = self.query_tasks(
+            current_workspace_id, limit=self.FETCH_PAGE_SIZE if self.lazy_loading else None
+        )
+        self.rebuild_task_rows()
+        self.layoutChanged.emit()
+
+    def query_tasks(self, workspace_id, after_task: TaskRow = None, limit: int = None):
+        """
+        Returns the tasks of this model's task type ordered by position along with whether there are more tasks left
+        in db after the returned ones. Only tasks after after_task are returned if it is passed and at most limit
+        tasks are returned if limit is passed
+        """
         with get_session(is_read_only=True) as session:
-            self.tasks = [
-                {
-                    "id": task.id,
-                    "task_name": task.task_name,
-                    "task_position": task.task_position,
-                    "elapsed_time": task.elapsed_time,  # in ms
-                    "target_time": task.target_time,  # in ms
-                    "icon": FluentIcon.PLAY if self.task_type == TaskType.TODO else FluentIcon.MENU,
-                }
-                for task in session.query(Task)
+            # only the needed columns are queried, so that no ORM objects have to be built for every task
+            query = (
+                session.query(Task.id, Task.task_name, Task.task_position, Task.elapsed_time, Task.target_time)
                 .filter(Task.task_type == self.task_type)
-                .filter(Task.workspace_id == current_workspace_id)
-                .order_by(Task.task_position)
-                .all()
+                .filter(Task.workspace_id == workspace_id)
+            )
+            if after_task is not None:
+                # keyset pagination, unlike an offset it stays correct when loaded tasks are removed from the list
+                query = query.filter(tuple_(Task.task_position, Task.id) > (after_task.task_position, after_task.id))
+            query = query.order_by(Task.task_position, Task.id)
+            if limit is not None:
+                query = query.limit(limit + 1)  # one extra row to find out if there are more tasks left
+
+            icon = self.defaultIcon()
+            tasks = [
+                TaskRow(task_id, task_name, task_position, elapsed_time, target_time, icon)
+                for task_id, task_name, task_position, elapsed_time, target_time in query
             ]
-        self.layoutChanged.emit()
+
+        has_more_tasks = limit is not None and len(tasks) > limit
+        if has_more_tasks:
+            tasks.pop()
+        return tasks, has_more_tasks
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.has_more_tasks
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.has_more_tasks:
+            return
+
+        # positions of loaded tasks could have changed in memory, they have to be in db for the keyset to be right
+        self.update_db()
+        task_write_queue.flush()
+
+        new_tasks, self.has_more_tasks = self.query_tasks(
+            WorkspaceLookup.get_current_workspace_id(),
+            after_task=self.tasks[-1] if self.tasks else None,
+            limit=self.FETCH_PAGE_SIZE,
+        )
+        if not new_tasks:
+            return
+
+        start_row = len(self.tasks)
+        self.beginInsertRows(QModelIndex(), start_row, start_row + len(new_tasks) - 1)
+        self.tasks.extend(new_tasks)
+        self.rebuild_task_rows(start_row)
+        self.endInsertRows()
+
+    def shift_unloaded_tasks(self, first_free_position):
+        """
+        Makes sure that the tasks which aren't loaded yet are at positions from first_free_position onwards, keeping
+        their order. So the loaded tasks can be renumbered from 0 without loading the rest of the list. They are only
+        moved, in one UPDATE, if they are in the way and then UNLOADED_POSITION_GAP further than needed
+        """
+        if not self.has_more_tasks or not self.tasks:
+            return
+
+        # keyset of the last loaded task has to match the db
+        self.update_db()
+        task_write_queue.flush()
+
+        last_task = self.tasks[-1]
+        is_unloaded = (
+            Task.task_type == self.task_type,
+            Task.workspace_id == WorkspaceLookup.get_current_workspace_id(),
+            tuple_(Task.task_position, Task.id) > (last_task.task_position, last_task.id),
+        )
+        with get_session() as session:
+            first_position = session.query(func.min(Task.task_position)).filter(*is_unloaded).scalar()
+            if first_position is not None and first_position < first_free_position:
+                session.execute(
+                    update(Task)
+                    .where(*is_unloaded)
+                    .values(
+                        task_position=Task.task_position
+                        + (first_free_position - first_position + self.UNLOADED_POSITION_GAP)
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+
+    def rebuild_task_rows(self, start_row=0):
+        """
+        Updates the id -> row lookup for every task from start_row onwards, rows before start_row are unaffected by
+        insertions and removals at start_row
+        """
+        if start_row == 0:
+            self.task_rows = {}
+        for row in range(start_row, len(self.tasks)):
+            self.task_rows[self.tasks[row].id] = row
+
+    def defaultIcon(self):
+        return FluentIcon.PLAY if self.task_type == TaskType.TODO else FluentIcon.MENU
+
+    def rowForTaskId(self, task_id):
+        return self.task_rows.get(task_id)
 
     def index(self, row, column=0, parent=QModelIndex()):
         return self.createIndex(row, column)
 
     def data(self, index, role=...):
         if role == Qt.DisplayRole:
-            return self.tasks[index.row()]["task_name"]
+            return self.tasks[index.row()].task_name
         elif role == self.ElapsedTimeRole:
             task = self.tasks[index.row()]
-            return task["elapsed_time"]
+            return task.elapsed_time
         elif role == self.TargetTimeRole:
             task = self.tasks[index.row()]
-            return task["target_time"]
+            return task.target_time
         elif role == self.IDRole:
             task = self.tasks[index.row()]
-            return task["id"]
+            return task.id
         elif role == self.IconRole:
             task = self.tasks[index.row()]
-            return task["icon"]
+            return task.icon
         elif role == Qt.ItemDataRole.BackgroundRole:
-            if self.current_task_id == self.tasks[index.row()]["id"]:
+            if self.current_task_id == self.tasks[index.row()].id:
                 theme_color: QColor = AppSettings.get(AppSettings, AppSettings.themeColor)
                 return theme_color  # use theme color to color current task
             else:
@@ -87,14 +212,16 @@ class TaskListModel(QAbstractListModel):
             row = index.row()
             task_name = value.strip()
             if task_name:
-                self.tasks[row]["task_name"] = task_name
+                self.tasks[row].task_name = task_name
+                self.mark_dirty(row, "task_name")
                 self.update_db()
                 self.dataChanged.emit(index, index)
                 return True
         elif role == self.ElapsedTimeRole:
             row = index.row()
             elapsed_time = value
-            self.tasks[row]["elapsed_time"] = elapsed_time
+            self.tasks[row].elapsed_time = elapsed_time
+            self.mark_dirty(row, "elapsed_time")
             if update_db:
                 self.update_db()
             self.dataChanged.emit(index, index)
@@ -102,14 +229,15 @@ class TaskListModel(QAbstractListModel):
         elif role == self.TargetTimeRole:
             row = index.row()
             target_time = value
-            self.tasks[row]["target_time"] = target_time
+            self.tasks[row].target_time = target_time
+            self.mark_dirty(row, "target_time")
             self.update_db()
             self.dataChanged.emit(index, index)
             return True
         elif role == self.IconRole:
             row = index.row()
             icon = value
-            self.tasks[row]["icon"] = icon
+            self.tasks[row].icon = icon
             self.dataChanged.emit(index, index)
             return True
         return False
@@ -131,14 +259,15 @@ class TaskListModel(QAbstractListModel):
         # First update the elapsed time for the task before drag starts
         if self.task_type == TaskType.TODO and self.current_task_id is not None:
             # Update the database with the current elapsed time to avoid losing time during drag
-            current_task_index = None
-            for i, task in enumerate(self.tasks):
-                if task["id"] == self.current_task_id:
-                    current_task_index = self.index(i)
-                    break
+            current_task_row = self.rowForTaskId(self.current_task_id)
 
-            if current_task_index is not None:
-                self.setData(current_task_index, task["elapsed_time"], self.ElapsedTimeRole, update_db=True)
+            if current_task_row is not None:
+                self.setData(
+                    self.index(current_task_row),
+                    self.tasks[current_task_row].elapsed_time,
+                    self.ElapsedTimeRole,
+                    update_db=True,
+                )
 
         mime_data = QMimeData()
         encoded_data = QByteArray()
@@ -150,18 +279,18 @@ class TaskListModel(QAbstractListModel):
             if index.isValid():
                 row = index.row()
                 rows_being_dragged.append(row)
-                task_id = self.tasks[row]["id"]
+                task_id = self.tasks[row].id
                 stream.writeInt32(row)
                 stream.writeInt32(task_id)
-                stream.writeQString(self.tasks[row]["task_name"])
-                stream.writeInt64(self.tasks[row]["elapsed_time"])
-                stream.writeInt64(self.tasks[row]["target_time"])
+                stream.writeQString(self.tasks[row].task_name)
+                stream.writeInt64(self.tasks[row].elapsed_time)
+                stream.writeInt64(self.tasks[row].target_time)
 
         # Store the indices being dragged in the mime data for later use
         task_ids_bytes = QByteArray()
         id_stream = QDataStream(task_ids_bytes, QIODevice.WriteOnly)
         for row in rows_being_dragged:
-            id_stream.writeInt32(self.tasks[row]["id"])
+            id_stream.writeInt32(self.tasks[row].id)
         mime_data.setData("application/x-task-ids", task_ids_bytes)
 
         # Don't update task positions or database here - we'll do that in dropMimeData
@@ -209,27 +338,27 @@ class TaskListModel(QAbstractListModel):
             # For the current task, check if we need to update the elapsed time from in-memory cache
             if self.task_type == TaskType.TODO and self.current_task_id == task_id:
                 # Get the latest in-memory elapsed time value
-                for existing_task in self.tasks:
-                    if existing_task["id"] == task_id:
-                        # Use the most up-to-date value
-                        elapsed_time = existing_task["elapsed_time"]
-                        logger.debug(f"Updated elapsed time for current task during drop: {elapsed_time}")
-                        break
-
-            drop_tasks.append({
-                "id": task_id,
-                "task_name": task_name,
-                "task_position": None,  # Will be set later
-                "elapsed_time": elapsed_time,
-                "target_time": target_time,
-                "icon": FluentIcon.PLAY if self.task_type == TaskType.TODO else FluentIcon.MENU,
-            })
+                existing_task_row = self.rowForTaskId(task_id)
+                if existing_task_row is not None:
+                    # Use the most up-to-date value
+                    elapsed_time = self.tasks[existing_task_row].elapsed_time
+                    logger.debug(f"Updated elapsed time for current task during drop: {elapsed_time}")
+
+            drop_tasks.append(
+                TaskRow(
+                    id=task_id,
+                    task_name=task_name,
+                    task_position=None,  # Will be set later
+                    elapsed_time=elapsed_time,
+                    target_time=target_time,
+                    icon=self.defaultIcon(),
+                )
+            )
 
         # Find which tasks in our current model need to be removed (moved)
-        task_id_to_original_row = {}
-        for i, task in enumerate(self.tasks):
-            if task["id"] in task_ids:
-                task_id_to_original_row[task["id"]] = i
+        task_id_to_original_row = {
+            task_id: self.task_rows[task_id] for task_id in task_ids if task_id in self.task_rows
+        }
 
         # Adjust the drop position if we're moving tasks from above the drop position
         # This accounts for the "gap" created by removing items
@@ -243,7 +372,7 @@ class TaskListModel(QAbstractListModel):
 
         # Check if this is a drop in the exact same position
         if len(task_id_to_original_row) == 1 and len(drop_tasks) == 1:
-            original_pos = task_id_to_original_row[drop_tasks[0]["id"]]
+            original_pos = task_id_to_original_row[drop_tasks[0].id]
             # Check if we're dropping at the same position
             if original_pos == drop_position:
                 logger.debug(f"Task dropped at same position: {original_pos} -> {drop_position}")
@@ -253,7 +382,7 @@ class TaskListModel(QAbstractListModel):
         new_tasks = []
 
         # Create a copy of the tasks excluding the ones being moved
-        filtered_tasks = [task for task in self.tasks if task["id"] not in task_ids]
+        filtered_tasks = [task for task in self.tasks if task.id not in task_id_to_original_row]
 
         # Insert all tasks before the drop position
         for i in range(drop_position):
@@ -269,52 +398,71 @@ class TaskListModel(QAbstractListModel):
         for i in range(drop_position, len(filtered_tasks)):
             new_tasks.append(filtered_tasks[i])
 
-        # Set task positions
+        # Set task positions, only loaded tasks are renumbered and the ones after them are shifted in db to make room
+        self.shift_unloaded_tasks(len(new_tasks))
         for i, task in enumerate(new_tasks):
-            task["task_position"] = i
+            task.task_position = i
 
         # Emit signals for moved tasks
         for task in drop_tasks:
-            self.taskMovedSignal.emit(task["id"], self.task_type)
+            self.taskMovedSignal.emit(task.id, self.task_type)
 
         # Replace the tasks list with our new ordered list
         self.beginResetModel()
         self.tasks = new_tasks
+        self.rebuild_task_rows()
         self.endResetModel()
 
-        # Update database
-        self.update_db()
+        # Update database, every loaded task is rewritten as positions, task type and workspace of the moved tasks have
+        # changed
+        self.update_db(full_update=True)
 
         # emit layoutChanged to notify the view of the changes
         self.layoutChanged.emit()
 
         logger.debug(f"Task type: {self.task_type}")
-        logger.debug(f"Tasks after drop: {[t['id'] for t in self.tasks]}")
+        logger.debug(f"Tasks after drop: {[t.id for t in self.tasks]}")
 
         return True
 
-    def update_db(self):
+    def mark_dirty(self, row, *columns):
+        """
+        Marks columns of the task at row as changed so that they are written to db on the next update_db() call
+        """
+        self.dirty_tasks.setdefault(self.tasks[row].id, set()).update(columns)
+
+    def update_db(self, full_update=False):
         """
-        updating db, using bulk insert
+        updating db, using bulk update through task_write_queue which writes it from a worker thread
         https://docs.sqlalchemy.org/en/20/orm/queryguide/dml.html#orm-queryguide-bulk-update
+
+        Only the dirty columns of dirty tasks are written unless full_update is True, in which case every task in the
+        list is rewritten
         """
-        current_workspace_id = WorkspaceLookup.get_current_workspace_id()
-        with get_session() as session:
-            session.execute(
-                update(Task),
-                [
-                    {
-                        "id": task["id"],
-                        "workspace_id": current_workspace_id,
-                        "task_name": task["task_name"],
-                        "task_type": self.task_type,
-                        "task_position": task["task_position"],
-                        "elapsed_time": task["elapsed_time"],
-                        "target_time": task["target_time"],
-                    }
-                    for task in self.tasks
-                ],
-            )
+        if full_update:
+            current_workspace_id = WorkspaceLookup.get_current_workspace_id()
+            task_updates = [
+                {
+                    "id": task.id,
+                    "workspace_id": current_workspace_id,
+                    "task_name": task.task_name,
+                    "task_type": self.task_type,
+                    "task_position": task.task_position,
+                    "elapsed_time": task.elapsed_time,
+                    "target_time": task.target_time,
+                }
+                for task in self.tasks
+            ]
+        else:
+            task_updates = []
+            for task_id, columns in self.dirty_tasks.items():
+                task = self.tasks[self.task_rows[task_id]]
+                task_updates.append({"id": task_id, **{column: getattr(task, column) for column in columns}})
+
+        self.dirty_tasks = {}
+
+        if task_updates:
+            task_write_queue.enqueue(task_updates)
 
     def flags(self, index):
         if not index.isValid():
@@ -358,18 +506,19 @@ class TaskListModel(QAbstractListModel):
             session.commit()
             new_id = task.id
 
-        task_list_new_member = {
-            "id": new_id,
-            "task_name": task_name,
-            "task_position": row,
-            "elapsed_time": 0,
-            "target_time": 0,
-            "icon": FluentIcon.PLAY if self.task_type == TaskType.TODO else FluentIcon.MENU,
-        }
+        task_list_new_member = TaskRow(
+            id=new_id,
+            task_name=task_name,
+            task_position=row,
+            elapsed_time=0,
+            target_time=0,
+            icon=self.defaultIcon(),
+        )
 
         logger.debug(f"Task list new member: {task_list_new_member}")
 
         self.tasks.insert(row, task_list_new_member)
+        self.rebuild_task_rows(row)
         self.endInsertRows()
         self.layoutChanged.emit()
         return True
@@ -382,13 +531,20 @@ class TaskListModel(QAbstractListModel):
         for i in range(count):
             logger.debug(f"tasks: {self.tasks}")
             logger.debug(f"Removing task at row: {row}")
+            # removed task is either deleted or now belongs to the other list, so its pending changes aren't ours to
+            # write anymore
+            self.dirty_tasks.pop(self.tasks[row].id, None)
+            self.task_rows.pop(self.tasks[row].id, None)
             del self.tasks[row]
             logger.debug(f"tasks: {self.tasks}")
+        self.rebuild_task_rows(row)
         self.endRemoveRows()
 
         # Update task positions
         for i, task in enumerate(self.tasks):
-            task["task_position"] = i
+            if task.task_position != i:
+                task.task_position = i
+                self.mark_dirty(i, "task_position")
 
         self.layoutChanged.emit()
         return True
@@ -398,17 +554,15 @@ class TaskListModel(QAbstractListModel):
         will remove rows as well as delete from database
         """
         logger.debug(f"Deleting task at row: {row}")
-        task_id = self.tasks[row]["id"]
+        task_id = self.tasks[row].id
+        task_write_queue.discard(task_id)  # no point in writing updates of a task which is about to be deleted
         # get index of row
         with get_session() as session:
             task = session.query(Task).get(task_id)
             session.delete(task)
 
         logger.debug(f"tasks: {self.tasks}")
-        self.removeRows(row, 1, parent)
-
-        for i, task in enumerate(self.tasks):
-            task["task_position"] = i
+        self.removeRows(row, 1, parent)  # marks the tasks whose position has changed as dirty
 
         self.update_db()
         self.taskDeletedSignal.emit(task_id)
@@ -416,16 +570,14 @@ class TaskListModel(QAbstractListModel):
         return True
 
     def setIconForTask(self, row, icon):
-        self.tasks[row]["icon"] = icon
+        self.tasks[row].icon = icon
         self.dataChanged.emit(self.index(row, 0), self.index(row, 0), [self.IconRole])
 
     def getTaskNameById(self, task_id):
-        for task in self.tasks:
-            if task["id"] == task_id:
-                return task["task_name"]
-        return None
+        row = self.rowForTaskId(task_id)
+        return self.tasks[row].task_name if row is not None else None
 
     def currentTaskIndex(self):
-        for task in self.tasks:
-            if task["id"] == self.current_task_id:
-                return self.index(task["task_position"], 0)
+        row = self.rowForTaskId(self.current_task_id)
+        if row is not None:
+            return self.index(row, 0)
@@ -1,16 +1,19 @@
 from models.db_tables import Task
+from models.task_write_queue import task_write_queue
 from utils.db_utils import get_session
 
 
 class TaskLookup:
     @staticmethod
     def get_elapsed_time(task_id: int):
+        task_write_queue.flush()  # queued updates of the task might not be in the db yet
         with get_session(is_read_only=True) as session:
             task = session.get(Task, task_id)
         return task.elapsed_time if task else None
 
     @staticmethod
     def get_target_time(task_id: int):
+        task_write_queue.flush()
         with get_session(is_read_only=True) as session:
             task = session.get(Task, task_id)
         return task.target_time if task else None
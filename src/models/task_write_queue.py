@@ -0,0 +1,126 @@
+import threading
+
+from loguru import logger
+from PySide6.QtCore import QObject, Qt, QThread, QTimer, Signal
+from sqlalchemy import bindparam, update
+
+from models.config import app_settings
+from models.db_tables import Task
+from utils.db_utils import get_scoped_session, get_session, remove_scoped_session
+
+
+class TaskWriteQueue(QObject):
+    """
+    Write-behind queue for updates to the tasks table. Updates are coalesced in memory per task and flushed to the db
+    in one transaction from a worker thread every flush interval, so that timer ticks don't wait on the disk.
+    """
+
+    flushRequested = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self._pending = {}  # task id -> dict of column -> latest value
+        self._pending_lock = threading.Lock()  # guards self._pending, held only for in memory operations
+        self._flush_lock = threading.Lock()  # makes sure that batches are written to db in the order they were taken
+        self._thread = None
+        self._flush_timer = None
+        self.flushRequested.connect(self.flush)
+
+    def start(self):
+        """Start flushing from a worker thread, until then every enqueued update is written immediately."""
+        if self._thread is not None:
+            return
+
+        self._thread = QThread()
+        self.moveToThread(self._thread)
+        self._thread.started.connect(self._startFlushTimer)
+        # finished is emitted from the worker thread itself, so the session of that thread can be removed there
+        self._thread.finished.connect(self._onThreadFinished, Qt.ConnectionType.DirectConnection)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread and write whatever is still pending from the calling thread."""
+        if self._thread is not None and self._thread.isRunning():
+            self._thread.quit()
+            self._thread.wait()
+        self.flush()
+
+    def _startFlushTimer(self):
+        # created here so that the timer belongs to the worker thread
+        self._flush_timer = QTimer()
+        self._flush_timer.setTimerType(Qt.TimerType.CoarseTimer)
+        self._flush_timer.timeout.connect(self.flush)
+        self._flush_timer.start(app_settings.get(app_settings.task_write_interval))
+
+    def _onThreadFinished(self):
+        if self._flush_timer is not None:
+            self._flush_timer.stop()
+        remove_scoped_session()
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.isRunning()
+
+    def enqueue(self, task_updates: list[dict]):
+        """
+        Queue updates for the tasks table, every dict needs an "id" key along with the columns to update. Columns
+        which are already pending for a task are overwritten by the newer value.
+        """
+        with self._pending_lock:
+            for task_update in task_updates:
+                self._pending.setdefault(task_update["id"], {}).update(task_update)
+
+        if not self.isRunning():
+            self.flush()
+
+    def discard(self, task_id: int):
+        """Drop pending updates of a task, used when the task is deleted from db."""
+        with self._pending_lock:
+            self._pending.pop(task_id, None)
+
+    def requestFlush(self):
+        """Flush pending updates from the worker thread as soon as possible, without blocking the caller."""
+        if self.isRunning():
+            self.flushRequested.emit()
+        else:
+            self.flush()
+
+    def flush(self):
+        """Write every pending update in one transaction. Can be called from any thread, blocks until written."""
+        with self._flush_lock:
+            with self._pending_lock:
+                if not self._pending:
+                    return
+                batch = self._pending
+                self._pending = {}
+
+            # only the worker thread keeps a session of its own, which is removed once it finishes. Flushes from any
+            # other thread, like the GUI thread in load_data(), use a session which is closed right away
+            is_worker_thread = self._thread is not None and QThread.currentThread() == self._thread
+            try:
+                with get_scoped_session() if is_worker_thread else get_session() as session:
+                    self._write(session, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} queued task updates to db: {e}")
+                # put the batch back without overwriting values which have been queued in the meantime, so that
+                # it is retried on the next flush
+                with self._pending_lock:
+                    for task_id, task_update in batch.items():
+                        self._pending[task_id] = {**task_update, **self._pending.get(task_id, {})}
+
+    @staticmethod
+    def _write(session, batch: dict):
+        # core executemany instead of an ORM bulk update by primary key, which raises StaleDataError for the whole
+        # batch if one of its tasks has been deleted in the meantime. Updates of deleted tasks simply match no row here
+        tasks_table = Task.__table__
+        updates_by_columns = {}  # rows of an executemany have to update the same columns
+        for task_update in batch.values():
+            columns = tuple(sorted(column for column in task_update if column != "id"))
+            row = {column: task_update[column] for column in columns}
+            row["task_id"] = task_update["id"]
+            updates_by_columns.setdefault(columns, []).append(row)
+
+        for rows in updates_by_columns.values():
+            session.execute(update(tasks_table).where(tasks_table.c.id == bindparam("task_id")), rows)
+
+
+task_write_queue = TaskWriteQueue()
@@ -1,11 +1,13 @@
 import sys
+import time
 
 from loguru import logger
-from PySide6.QtCore import QObject, QTimer, Signal
+from PySide6.QtCore import QObject, Qt, QTimer, Signal
 from PySide6.QtWidgets import QApplication
 
 from config_values import ConfigValues
 from constants import TimerState
+from models.config import app_settings
 
 
 class PomodoroTimer(QObject):  # Inherit from QObject to support signals
@@ -21,6 +23,9 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
     sessionPausedSignal = Signal()
     sessionStartedSignal = Signal()
     durationSkippedSignal = Signal()
+    # emitted when the timer stops ticking, for the time which has passed since the latest timeout, so that it can be
+    # credited to the current task like a timeout would. Can be up to a task write interval while display isn't needed
+    finalTickSignal = Signal()
 
     def __init__(self):
         super().__init__()
@@ -35,10 +40,33 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
         self.sessions_completed = 0  # would be incremented by 1 after every long break is ended
 
         self.remaining_time = 0  # will change according to BREAK_DURATION, WORK_DURATION, LONG_BREAK_DURATION
+        # remaining_time is in milliseconds rounded up to timer_resolution, it is what gets displayed
         self.timer_resolution = 1000  # in milliseconds
 
+        # remaining time is computed from a deadline on the monotonic clock instead of being decremented on every
+        # timeout, so that late timeouts due to a busy event loop don't make the timer drift. Timeouts only update
+        # remaining_time for display
+        self.deadline_ns = None  # time.monotonic_ns() at which the running duration ends, None if not running
+        self.remaining_time_ns = 0  # exact remaining time while the timer isn't running
+        self.last_tick_remaining_time = 0  # remaining_time as of the previous timeout
+        self.tick_elapsed_time = 0  # ms of the duration which have passed between the previous and latest timeout
+
+        # when nothing visible shows the remaining time, timeouts are only needed for persisting the elapsed time of
+        # the current task and for ending the duration, so the timer wakes up far less often
+        self.display_needed = True
+
+        self.pomodoro_timer.setSingleShot(True)  # re-armed on every timeout according to the deadline
+        self.pomodoro_timer.setTimerType(Qt.TimerType.PreciseTimer)
+
+        # duration is ended from a separate zero delay timer so that every other slot connected to the timeout of
+        # pomodoro_timer sees the final timeout of the duration before the timer state changes
+        self.duration_end_timer = QTimer()
+        self.duration_end_timer.setSingleShot(True)
+        self.duration_end_timer.setInterval(0)
+        self.duration_end_timer.timeout.connect(self.durationEnded)
+
         # self.pomodoro_timer.timeout.connect(self.sessionEnded)
-        self.pomodoro_timer.timeout.connect(self.decreaseRemainingTime)
+        self.pomodoro_timer.timeout.connect(self.updateRemainingTime)
 
     def getTimerState(self):
         return self.timer_state
@@ -88,7 +116,7 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
         """
         if self.remaining_time > 0 and not self.pomodoro_timer.isActive():  # if timer is paused
             logger.info("Resuming timer")
-            self.pomodoro_timer.start(self.timer_resolution)
+            self.startTicking()
         else:  # if timer is not paused then set timer duration and start timer
             if self.getTimerState() == TimerState.NOTHING:
                 logger.info("In Nothing State")
@@ -106,15 +134,80 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
                 logger.info("Starting long break session")
 
     def startDuration(self):
-        self.pomodoro_timer.start(self.timer_resolution)
+        self.startTicking()
         self.sessionStartedSignal.emit()
 
+    def startTicking(self):
+        """
+        Sets the deadline of the duration from the remaining time if it isn't running already and arms the timer for
+        the next timeout
+        """
+        if self.deadline_ns is None:
+            self.deadline_ns = time.monotonic_ns() + self.remaining_time_ns
+        self.scheduleNextTick()
+
+    def scheduleNextTick(self):
+        """
+        Arms the timer to time out when the remaining time drops to the next lower multiple of timer_resolution. If
+        display isn't needed, it is armed for the next task write interval or the end of the duration instead
+        """
+        remaining_ns = self.deadline_ns - time.monotonic_ns()
+        resolution_ns = self.timer_resolution * 1_000_000
+        if self.display_needed:
+            steps = 1
+        else:
+            steps = max(1, app_settings.get(app_settings.task_write_interval) // self.timer_resolution)
+        next_step_ns = max(0, (-(-remaining_ns // resolution_ns) - steps) * resolution_ns)  # ceil division
+        delay_ms = -(-(remaining_ns - next_step_ns) // 1_000_000)
+
+        # coarse timer lets the OS batch wakeups, end of duration is still timed precisely
+        if self.display_needed or next_step_ns == 0:
+            self.pomodoro_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        else:
+            self.pomodoro_timer.setTimerType(Qt.TimerType.CoarseTimer)
+        self.pomodoro_timer.start(max(1, delay_ms))
+
+    def setDisplayNeeded(self, display_needed: bool):
+        """
+        For telling the timer if something visible shows the remaining time every second
+        """
+        if display_needed == self.display_needed:
+            return
+
+        logger.debug(f"Timer display needed: {display_needed}")
+        self.display_needed = display_needed
+        if self.deadline_ns is None or not self.pomodoro_timer.isActive():
+            return
+
+        if display_needed:
+            # time out right away so that everything visible is brought up to date
+            self.pomodoro_timer.setTimerType(Qt.TimerType.PreciseTimer)
+            self.pomodoro_timer.start(0)
+        else:
+            self.scheduleNextTick()
+
     def pauseDuration(self):
         self.previous_timer_state = self.timer_state
         logger.info("Timer is paused now")
         self.pomodoro_timer.stop()
+        if self.deadline_ns is not None:
+            self.finalTick()
+            self.deadline_ns = None
         self.sessionPausedSignal.emit()
 
+    def finalTick(self):
+        """
+        Brings the remaining time up to date with the deadline and emits finalTickSignal if the duration has progressed
+        since the latest timeout. Called before the timer stops ticking
+        """
+        if self.deadline_ns is None:
+            return
+        self.setRemainingTimeNs(max(0, self.deadline_ns - time.monotonic_ns()))
+        self.tick_elapsed_time = self.last_tick_remaining_time - self.remaining_time
+        self.last_tick_remaining_time = self.remaining_time
+        if self.tick_elapsed_time > 0:
+            self.finalTickSignal.emit()
+
     def durationEnded(self, isSkipped=False):
         """
         Handles the end of the work session, break session or long break session
@@ -125,6 +218,8 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
             logger.info(f"Sessions completed: {self.sessions_completed}")
 
         self.pomodoro_timer.stop()
+        self.duration_end_timer.stop()
+        self.deadline_ns = None
         if self.timer_state == TimerState.WORK:
             self.updateSessionProgress(isSkipped)
             self.setDuration()
@@ -163,7 +258,9 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
             logger.info("Skipping duration when timer is doing nothing")
         else:
             logger.info("Skipping duration when timer is doing something")
-            self.remaining_time = 0
+            self.finalTick()
+            self.deadline_ns = None
+            self.setRemainingTimeNs(0)
             self.durationEnded(isSkipped=True)
 
         self.durationSkippedSignal.emit()
@@ -172,22 +269,43 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
         """
         for setting the duration of the timer
         """
-        self.remaining_time = duration
+        self.deadline_ns = None
+        self.setRemainingTimeNs(duration * 1_000_000)
+        self.last_tick_remaining_time = self.remaining_time
+        self.tick_elapsed_time = 0
 
-    def decreaseRemainingTime(self):
+    def setRemainingTimeNs(self, remaining_time_ns):
         """
-        For decreasing the remaining time by timer_resolution
+        Sets the exact remaining time along with remaining_time, which is rounded up to timer_resolution
         """
+        self.remaining_time_ns = remaining_time_ns
+        resolution_ns = self.timer_resolution * 1_000_000
+        self.remaining_time = -(-remaining_time_ns // resolution_ns) * self.timer_resolution  # ceil division
+
+    def updateRemainingTime(self):
+        """
+        Computes the remaining time from the deadline on every timeout of pomodoro_timer
+        """
+        self.setRemainingTimeNs(max(0, self.deadline_ns - time.monotonic_ns()))
+        # more than one timer_resolution could have passed if the timeout was late
+        self.tick_elapsed_time = self.last_tick_remaining_time - self.remaining_time
+        self.last_tick_remaining_time = self.remaining_time
+
         if __name__ == "__main__":
             logger.debug(f"Remaining time (in seconds): {self.getRemainingTime() / 1000}")
 
-        self.remaining_time -= self.timer_resolution
-
-        if self.remaining_time < 0:
-            self.durationEnded()
+        if self.remaining_time_ns == 0:
+            self.deadline_ns = None
+            self.duration_end_timer.start()
             return
 
-        self.pomodoro_timer.start(self.timer_resolution)
+        self.scheduleNextTick()
+
+    def getTickElapsedTime(self):
+        """
+        Returns the time in milliseconds by which the duration has progressed between the previous and latest timeout
+        """
+        return self.tick_elapsed_time
 
     def getRemainingTime(self):
         """
@@ -204,7 +322,10 @@ class PomodoroTimer(QObject):  # Inherit from QObject to support signals
         self.previous_timer_state = self.timer_state
         self.sessions_completed = 0
         self.pomodoro_timer.stop()
-        self.remaining_time = 0
+        self.finalTick()
+        self.duration_end_timer.stop()
+        self.deadline_ns = None
+        self.setRemainingTimeNs(0)
         self.session_progress = 0
         self.timer_state = TimerState.NOTHING
         if self.previous_timer_state != self.timer_state:
@@ -8,6 +8,7 @@ from constants import URLListType, WebsiteFilterType
 from models.db_tables import AllowlistExceptionURL, AllowlistURL, BlocklistExceptionURL, BlocklistURL, Workspace
 from models.workspace_lookup import WorkspaceLookup
 from utils.db_utils import get_session
+from website_blocker.rule_compiler import CompiledRules, compile_rule, compile_rules, is_regex_address
 
 
 class WebsiteListManager(QObject):
@@ -18,6 +19,7 @@ class WebsiteListManager(QObject):
         self.blocklist_exception_urls = set()
         self.allowlist_urls = set()
         self.allowlist_exception_urls = set()
+        self.compiled_rules = {}  # URLListType -> CompiledRules, compiled when first needed
 
         self.website_filter_type = None
 
@@ -25,6 +27,11 @@ class WebsiteListManager(QObject):
         self.load_data()
 
     def load_data(self, target_list: URLListType = None):
+        if target_list is None:
+            self.compiled_rules.clear()
+        else:
+            self.compiled_rules.pop(target_list, None)
+
         with get_session(is_read_only=True) as session:
             current_workspace_id = WorkspaceLookup.get_current_workspace_id()
 
@@ -145,7 +152,15 @@ class WebsiteListManager(QObject):
             if not url.strip():  # skip empty strings
                 continue
 
-            url = self.add_default_scheme(url)  # add default scheme if not present
+            try:
+                compile_rule(url)
+            except ValueError:
+                invalid_urls_line_numbers.append(n)
+                continue
+            if is_regex_address(url):  # regexes aren't urls, compiling them is all the validation they need
+                continue
+
+            url = self.add_default_scheme(url.strip().removeprefix("*."))  # add default scheme if not present
 
             if not validators.url(url):
                 invalid_urls_line_numbers.append(n)
@@ -159,8 +174,9 @@ class WebsiteListManager(QObject):
 
     # helper function for update_target_list_urls()
     def add_urls(self, session, urls: set, target_class):
+        current_workspace_id = WorkspaceLookup.get_current_workspace_id()
         for url in urls:
-            session.add(target_class(workspace_id=WorkspaceLookup.get_current_workspace_id(), url=url))
+            session.add(target_class(workspace_id=current_workspace_id, url=url))
 
     # helper function for update_target_list_urls()
     def remove_urls(self, session, urls: set, target_class):
@@ -177,3 +193,12 @@ class WebsiteListManager(QObject):
             return self.allowlist_urls
         elif target_list == URLListType.ALLOWLIST_EXCEPTION:
             return self.allowlist_exception_urls
+
+    def get_compiled_rules(self, target_list: URLListType) -> CompiledRules:
+        """
+        Returns the urls of target_list compiled into rules for the website filter. Compiled rules are cached until
+        target_list is loaded again
+        """
+        if target_list not in self.compiled_rules:
+            self.compiled_rules[target_list] = compile_rules(self.get_urls(target_list))
+        return self.compiled_rules[target_list]
@@ -2,6 +2,7 @@ from loguru import logger
 from PySide6.QtCore import QAbstractListModel, QItemSelectionModel, QModelIndex, Qt, Signal
 
 from models.db_tables import CurrentWorkspace, Workspace
+from models.workspace_lookup import WorkspaceLookup
 from utils.db_utils import get_session
 
 
@@ -14,6 +15,10 @@ class WorkspaceListModel(QAbstractListModel):
         self.workspaces = []
         self.load_data()
         self.layoutChanged.connect(self.logList)
+        # connected before any other slot so that the cached current workspace id is dropped before anything else
+        # reacts to the change
+        self.current_workspace_changed.connect(WorkspaceLookup.invalidate_current_workspace_id)
+        self.current_workspace_deleted.connect(WorkspaceLookup.invalidate_current_workspace_id)
         self.selection_model: QItemSelectionModel = None
 
     def setSelectionModel(self, selection_model: QItemSelectionModel):
@@ -75,6 +80,10 @@ class WorkspaceListModel(QAbstractListModel):
                     session.delete(workspace)
                     if workspace_id == selected_workspace_id:
                         self.current_workspace_deleted.emit()
+            if workspace_id == selected_workspace_id:
+                # current_workspace row is only removed by the cascade on commit, slots of current_workspace_deleted
+                # could have cached the id of the deleted workspace again before that
+                WorkspaceLookup.invalidate_current_workspace_id()
             self.workspaces.pop(index)
             self.layoutChanged.emit()
 
@@ -102,9 +111,7 @@ class WorkspaceListModel(QAbstractListModel):
                     self.current_workspace_changed.emit()
 
     def get_current_workspace_id(self):
-        with get_session(is_read_only=True) as session:
-            current_workspace = session.query(CurrentWorkspace).first()
-        return current_workspace.current_workspace_id if current_workspace else None
+        return WorkspaceLookup.get_current_workspace_id()
 
     def get_workspace_name_by_id(self, workspace_id):
         for workspace in self.workspaces:
@@ -3,11 +3,23 @@ from utils.db_utils import get_session
 
 
 class WorkspaceLookup:
+    # id of the current workspace is cached for the whole process as it is looked up very frequently, None means that
+    # it has to be fetched from the db. WorkspaceListModel invalidates it whenever the current workspace changes
+    _current_workspace_id = None
+
     @staticmethod
     def get_current_workspace_id():
-        with get_session(is_read_only=True) as session:
-            current_workspace = session.query(CurrentWorkspace).first()
-        return current_workspace.current_workspace_id if current_workspace else None
+        if WorkspaceLookup._current_workspace_id is None:
+            with get_session(is_read_only=True) as session:
+                current_workspace = session.query(CurrentWorkspace).first()
+            WorkspaceLookup._current_workspace_id = (
+                current_workspace.current_workspace_id if current_workspace else None
+            )
+        return WorkspaceLookup._current_workspace_id
+
+    @staticmethod
+    def invalidate_current_workspace_id():
+        WorkspaceLookup._current_workspace_id = None
 
     @staticmethod
     def get_current_workspace_name():
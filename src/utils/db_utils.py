@@ -1,13 +1,18 @@
 from contextlib import contextmanager
 
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 from models.db_tables import engine
 
+# built only once, building a sessionmaker on every get_session() call was costing more than the queries themselves
+Session = sessionmaker(bind=engine)
+
+# thread local registry of sessions for code running inside of QThreads, each thread gets its own session
+ScopedSession = scoped_session(Session)
+
 
 @contextmanager
 def get_session(is_read_only=False):
-    Session = sessionmaker(bind=engine)
     session = Session()
     try:
         yield session
@@ -18,3 +23,23 @@ def get_session(is_read_only=False):
         raise
     finally:
         session.close()
+
+
+@contextmanager
+def get_scoped_session(is_read_only=False):
+    """
+    Same as get_session() but uses the session of the calling thread. Meant to be used from worker threads, call
+    remove_scoped_session() once the thread is done with the database
+    """
+    session = ScopedSession()
+    try:
+        yield session
+        if not is_read_only:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def remove_scoped_session():
+    ScopedSession.remove()
@@ -11,6 +11,7 @@ from config_values import ConfigValues
 from constants import APPLICATION_NAME
 from utils.find_mitmdump_executable import get_mitmdump_path
 from views.dialogs.postSetupVerificationDialog import PostSetupVerificationDialog
+from website_blocker.rule_compiler import compile_rules
 from website_blocker.website_blocker_manager import WebsiteBlockerManager
 
 
@@ -68,15 +69,16 @@ class SetupAppDialog(MessageBoxBase):
         confirmation_dialog = PostSetupVerificationDialog(self)
 
         if confirmation_dialog.exec():
-            self.temporary_website_blocker_manager.stop_filtering(delete_proxy=True)  # stopping website filtering here
+            self.temporary_website_blocker_manager.shutdown_filtering()  # stopping website filtering here
             # because this function will only be triggered after confirmation_dialog is accepted
+            self.temporary_website_blocker_manager.cleanup()
             self.accept()
 
     def initTemporaryWebsiteBlockerManager(self):
         self.temporary_website_blocker_manager = WebsiteBlockerManager()
         self.temporary_website_blocker_manager.start_filtering(
             listening_port=ConfigValues.PROXY_PORT,
-            joined_addresses="example.com",
+            rules=compile_rules(["example.com"]),
             block_type="blocklist",
             mitmdump_bin_path=get_mitmdump_path(),
         )
@@ -110,6 +110,22 @@ class SettingsView(QWidget, Ui_SettingsView):
             "Select the port where the website filter runs",
             self.website_filter_settings_group,
         )
+        self.proxy_routing_mode_card = OptionsSettingCard(
+            app_settings.proxy_routing_mode,
+            FluentIcon.GLOBE,
+            "Traffic Routing",
+            "Route all traffic through the website filter, or only traffic to websites in the filter lists",
+            texts=["All traffic", "Only filtered websites"],
+            parent=self.website_filter_settings_group,
+        )
+        self.proxy_engine_card = OptionsSettingCard(
+            app_settings.proxy_engine,
+            FluentIcon.SPEED_HIGH,
+            "Filtering Engine",
+            "mitmproxy blocks on full URLs, the built-in proxy and DNS sinkhole block on domains without a certificate",
+            texts=["mitmproxy", "Built-in proxy", "DNS sinkhole"],
+            parent=self.website_filter_settings_group,
+        )
 
         # Personalization Settings
         self.personalization_settings_group = SettingCardGroup(self.tr("Personalization"), self.scrollArea)
@@ -172,6 +188,8 @@ class SettingsView(QWidget, Ui_SettingsView):
 
         self.website_filter_settings_group.addSettingCard(self.enable_website_filter_card)
         self.website_filter_settings_group.addSettingCard(self.proxy_port_card)
+        self.website_filter_settings_group.addSettingCard(self.proxy_routing_mode_card)
+        self.website_filter_settings_group.addSettingCard(self.proxy_engine_card)
 
         self.proxy_port_card.spinBox.setSymbolVisible(False)
         self.proxy_port_card.spinBox.setMinimumWidth(150)
@@ -227,6 +245,8 @@ class SettingsView(QWidget, Ui_SettingsView):
         workspace_specific_settings.enable_website_filter.valueChanged.connect(self.updateEnableWebsiteFilter)
 
         app_settings.proxy_port.valueChanged.connect(self.updateProxyPort)
+        app_settings.proxy_routing_mode.valueChanged.connect(self.updateProxyRoutingMode)
+        app_settings.proxy_engine.valueChanged.connect(self.updateProxyEngine)
         app_settings.check_for_updates_on_start.valueChanged.connect(self.updateCheckForUpdatesOnStart)
 
     def updateBreakDuration(self):
@@ -271,6 +291,14 @@ class SettingsView(QWidget, Ui_SettingsView):
         ConfigValues.PROXY_PORT = app_settings.get(app_settings.proxy_port)
         logger.debug(f"Proxy Port: {app_settings.get(app_settings.proxy_port)}")
 
+    def updateProxyRoutingMode(self):
+        ConfigValues.PROXY_ROUTING_MODE = app_settings.get(app_settings.proxy_routing_mode)
+        logger.debug(f"Proxy Routing Mode: {app_settings.get(app_settings.proxy_routing_mode)}")
+
+    def updateProxyEngine(self):
+        ConfigValues.PROXY_ENGINE = app_settings.get(app_settings.proxy_engine)
+        logger.debug(f"Proxy Engine: {app_settings.get(app_settings.proxy_engine)}")
+
     def updateCheckForUpdatesOnStart(self):
         ConfigValues.CHECK_FOR_UPDATES_ON_START = app_settings.get(app_settings.check_for_updates_on_start)
         logger.debug(f"Check For Updates On Start: {app_settings.get(app_settings.check_for_updates_on_start)}")
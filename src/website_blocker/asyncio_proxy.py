@@ -0,0 +1,266 @@
+"""
+Lightweight forward proxy of the website filter, an alternative to mitmdump for blocking on hosts. It runs on an
+asyncio event loop in a thread of the app, so it doesn't need a mitmdump binary or an installed CA certificate.
+
+HTTPS is tunneled through CONNECT without being intercepted, so for HTTPS only the host is known. Rules which need the
+path of a URL (path prefixes and regexes) are matched against the root URL of the host then. Plain HTTP requests are
+matched on their full URL like in mitmdump.
+
+The proxy understands the same internal URLs as the filter addon of mitmdump and reads the same rule files, so the
+supervisor controls both the same way.
+"""
+
+import asyncio
+import json
+import time
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from constants import BLOCK_HTML_MESSAGE, MITMDUMP_CONTROL_URL, MITMDUMP_SHUTDOWN_URL, MITMDUMP_STATS_URL
+from website_blocker.rule_compiler import CompiledRules
+from website_blocker.rule_file import RuleFile, find_latest_rule_file
+from website_blocker.url_matcher import DecisionCache, HostDecision, UrlMatcher
+
+CONTROL_OPTIONS = {"block_type", "filtering_enabled", "activation_time"}
+LOCAL_HOSTS = {"127.0.0.1", "::1", "::ffff:127.0.0.1"}
+MAX_HEAD_SIZE = 64 * 1024  # in bytes, connections sending a larger request head are closed
+HEAD_TIMEOUT = 30  # in seconds, how long a client has to send the head of its request
+CONNECT_TIMEOUT = 10  # in seconds, how long connecting to the origin server may take
+SPLICE_BUFFER_SIZE = 256 * 1024  # in bytes
+
+
+class AsyncioProxy:
+    """
+    Forward proxy which blocks according to the newest rule file in rules_dir. Call run() from the thread it should
+    run on and stop() from any other thread
+    """
+
+    def __init__(self, listening_port: int, rules_dir: str):
+        self.listening_port = listening_port
+        self.rules_dir = rules_dir
+
+        self.block_type = ""
+        self.filtering_enabled = False  # enabled through a control request, like mitmdump
+        self.activation_time = 0.0
+        self.url_matcher = UrlMatcher.from_rules(CompiledRules())
+        self.rule_file = None
+        self.decision_cache = DecisionCache()
+        self.first_block_latency = None
+        self.first_block_activation_time = None
+
+        self.loop = None
+        self.stop_event = None
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        server = await asyncio.start_server(self._handle_client, "127.0.0.1", self.listening_port, limit=MAX_HEAD_SIZE)
+        logger.debug(f"asyncio proxy listening on port {self.listening_port}")
+        async with server:
+            await self.stop_event.wait()
+        if self.rule_file is not None:
+            self.rule_file.close()
+        logger.debug("asyncio proxy has stopped")
+
+    def reload_rules(self):
+        latest_rule_file = find_latest_rule_file(self.rules_dir)
+        if latest_rule_file is None or self.rule_file is not None and latest_rule_file[0] == self.rule_file.version:
+            return
+
+        try:
+            new_rule_file = RuleFile(latest_rule_file[1])
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load rule file {latest_rule_file[1]}: {e}")
+            return
+
+        self.url_matcher = new_rule_file.matcher()
+        self.decision_cache.clear()  # cached results are of the old rules
+        if self.rule_file is not None:
+            self.rule_file.close()
+        self.rule_file = new_rule_file
+        logger.debug(f"asyncio proxy loaded rule file version {self.rule_file.version}")
+
+    def is_blocked(self, host: str, url: str) -> bool:
+        key = self.url_matcher.cache_key(host, url)
+        has_match = self.decision_cache.get(key)
+        if has_match is None:
+            has_match = self.url_matcher.matches(host, url)
+            self.decision_cache.put(key, has_match)
+        return self._is_blocked_match(has_match)
+
+    def is_host_blocked(self, host: str) -> bool:
+        decision = self.url_matcher.host_decision(host)
+        if decision == HostDecision.UNDECIDED:  # path of a tunneled request isn't known
+            return self.is_blocked(host, f"https://{host}/")
+        return self._is_blocked_match(decision == HostDecision.MATCH)
+
+    def _is_blocked_match(self, has_match: bool) -> bool:
+        is_blocked = self.block_type == "allowlist" and not has_match or self.block_type == "blocklist" and has_match
+        if is_blocked:
+            self.log_first_block()
+        return is_blocked
+
+    def log_first_block(self):
+        if not self.activation_time or self.activation_time == self.first_block_activation_time:
+            return
+
+        self.first_block_activation_time = self.activation_time
+        self.first_block_latency = time.time() - self.activation_time
+        logger.info(f"First blocked response {self.first_block_latency * 1000:.0f} ms after filtering was requested")
+
+    async def _handle_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        try:
+            try:
+                head = await asyncio.wait_for(client_reader.readuntil(b"\r\n\r\n"), HEAD_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = request_line.split(" ")
+            except ValueError:
+                await self._respond(client_writer, 400, b"Bad request\n")
+                return
+            headers = [line for line in header_lines if line]
+
+            if method == "CONNECT":
+                await self._handle_connect(client_reader, client_writer, target)
+            else:
+                await self._handle_request(client_reader, client_writer, method, target, version, headers)
+        except (ConnectionError, OSError) as e:
+            logger.debug(f"asyncio proxy connection failed: {e}")
+        finally:
+            client_writer.close()
+
+    async def _handle_connect(self, client_reader, client_writer, target: str):
+        host, _, port = target.rpartition(":")
+        host = host.strip("[]")
+        if not host or not port.isdigit():
+            await self._respond(client_writer, 400, b"Bad request\n")
+            return
+
+        if self.filtering_enabled and self.is_host_blocked(host):
+            await self._respond(client_writer, 403, b"Blocked\n")
+            return
+
+        try:
+            server_reader, server_writer = await asyncio.wait_for(
+                asyncio.open_connection(host, int(port)), CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            await self._respond(client_writer, 502, b"Bad gateway\n")
+            return
+
+        client_writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        await self._splice(client_reader, client_writer, server_reader, server_writer)
+
+    async def _handle_request(self, client_reader, client_writer, method, target, version, headers):
+        url = urlsplit(target)
+        if url.scheme != "http" or not url.hostname:  # https is tunneled through CONNECT
+            await self._respond(client_writer, 400, b"Only absolute http URLs are supported\n")
+            return
+
+        if target == MITMDUMP_SHUTDOWN_URL:
+            await self._respond(client_writer, 200, b"Shutting down asyncio proxy...\n")
+            self.stop_event.set()
+            return
+        if target == MITMDUMP_CONTROL_URL:
+            await self._control(client_reader, client_writer, headers)
+            return
+        if target == MITMDUMP_STATS_URL:
+            stats = {**self.decision_cache.stats(), "first_block_latency": self.first_block_latency}
+            await self._respond(client_writer, 200, json.dumps(stats).encode(), "application/json")
+            return
+
+        if self.filtering_enabled and self.is_blocked(url.hostname, target):
+            await self._respond(client_writer, 200, BLOCK_HTML_MESSAGE.encode(), "text/html")
+            return
+
+        try:
+            server_reader, server_writer = await asyncio.wait_for(
+                asyncio.open_connection(url.hostname, url.port or 80), CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            await self._respond(client_writer, 502, b"Bad gateway\n")
+            return
+
+        # origin server gets the request in origin form, one request per connection so that a keep-alive connection
+        # of the client can't reach another host without being filtered
+        path = url.path or "/"
+        if url.query:
+            path += f"?{url.query}"
+        forwarded_headers = [
+            header
+            for header in headers
+            if header.split(":", 1)[0].strip().lower() not in ("connection", "proxy-connection", "keep-alive")
+        ]
+        head = "\r\n".join([f"{method} {path} {version}", *forwarded_headers, "Connection: close", "", ""])
+        server_writer.write(head.encode("latin-1"))
+        await self._splice(client_reader, client_writer, server_reader, server_writer)
+
+    async def _control(self, client_reader, client_writer, headers):
+        peername = client_writer.get_extra_info("peername")
+        if not peername or peername[0] not in LOCAL_HOSTS:
+            await self._respond(client_writer, 403, b"Forbidden\n")
+            return
+
+        content_length = 0
+        for header in headers:
+            name, _, value = header.partition(":")
+            if name.strip().lower() == "content-length" and value.strip().isdigit():
+                content_length = int(value.strip())
+
+        try:
+            updates = json.loads(await client_reader.readexactly(content_length) or b"{}")
+            for name, value in updates.items():
+                if name in CONTROL_OPTIONS:
+                    setattr(self, name, value)
+            self.reload_rules()  # rule file is written before the control request is sent
+        except (ValueError, AttributeError, asyncio.IncompleteReadError) as e:
+            await self._respond(client_writer, 400, f"{e}\n".encode())
+            return
+
+        await self._respond(client_writer, 200, b"OK\n")
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str = "text/plain"):
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _splice(client_reader, client_writer, server_reader, server_writer):
+        """Copies data both ways until one of the sides closes its connection"""
+
+        async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                while data := await reader.read(SPLICE_BUFFER_SIZE):
+                    writer.write(data)
+                    await writer.drain()
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                if writer.can_write_eof():
+                    try:
+                        writer.write_eof()
+                    except OSError:
+                        pass
+
+        try:
+            await asyncio.gather(pipe(client_reader, server_writer), pipe(server_reader, client_writer))
+        finally:
+            server_writer.close()
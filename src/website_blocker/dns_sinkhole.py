@@ -0,0 +1,472 @@
+"""
+DNS sinkhole of the website filter, an alternative to filtering through a proxy. A stub resolver on localhost answers
+queries for blocked hosts with 0.0.0.0 (:: for AAAA queries, NXDOMAIN for other types) and forwards the rest to the
+upstream resolver, caching its responses. So blocking costs one lookup per host instead of an intercepted connection.
+
+Only hosts are known to a resolver, rules which need the path of a URL (path prefixes and regexes) are matched against
+the root URL of the host. Resolvers of the system and browsers cache answers, so a change in the rules can take until
+their TTL runs out to take effect, and browsers using DNS over HTTPS bypass the sinkhole.
+"""
+
+import asyncio
+import ipaddress
+import platform
+import re
+import shutil
+import struct
+import subprocess
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+from website_blocker.rule_compiler import CompiledRules, is_ip_address
+from website_blocker.rule_file import RuleFile, find_latest_rule_file
+from website_blocker.url_matcher import DecisionCache, HostDecision, UrlMatcher
+
+DNS_PORT = 53  # resolvers of the system can only be pointed at this port
+FALLBACK_UPSTREAM_RESOLVER = "1.1.1.1"
+CONTROL_OPTIONS = {"block_type", "filtering_enabled", "activation_time"}
+CONTROL_TIMEOUT = 2  # in seconds
+UPSTREAM_TIMEOUT = 3  # in seconds
+BLOCKED_TTL = 60  # in seconds, TTL of answers for blocked hosts
+MAX_CACHE_TTL = 300  # in seconds, responses are cached for their smallest TTL but at most this long
+NEGATIVE_CACHE_TTL = 30  # in seconds, for responses without any records
+RESPONSE_CACHE_SIZE = 4096
+
+_HEADER = struct.Struct("!HHHHHH")
+_RECORD = struct.Struct("!HHIH")  # type, class, ttl, rdlength
+QTYPE_A = 1
+QTYPE_AAAA = 28
+QTYPE_OPT = 41
+RCODE_NXDOMAIN = 3
+RCODE_SERVFAIL = 2
+
+
+def _skip_name(message: bytes, offset: int) -> int:
+    """Returns the offset right after the possibly compressed name at offset"""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:  # pointer, ends the name
+            return offset + 2
+        offset += length + 1
+        if length == 0:
+            return offset
+
+
+def parse_question(message: bytes) -> tuple[str, int, int, int]:
+    """Returns name, type and class of the first question of a query and the offset after it. Raises ValueError"""
+    try:
+        if _HEADER.unpack_from(message)[2] < 1:
+            raise ValueError("Query without a question")
+
+        labels = []
+        offset = _HEADER.size
+        while length := message[offset]:
+            if length & 0xC0:
+                raise ValueError("Compressed name in question")
+            labels.append(message[offset + 1 : offset + 1 + length].decode("ascii"))
+            offset += length + 1
+        qtype, qclass = struct.unpack_from("!HH", message, offset + 1)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed query: {e}") from e
+    return ".".join(labels).lower(), qtype, qclass, offset + 5
+
+
+def min_ttl(response: bytes) -> int:
+    """Smallest TTL of the records of response, NEGATIVE_CACHE_TTL if it has none"""
+    _, _, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(response)
+    offset = _HEADER.size
+    for _ in range(qdcount):
+        offset = _skip_name(response, offset) + 4
+
+    ttls = []
+    for _ in range(ancount + nscount + arcount):
+        offset = _skip_name(response, offset)
+        rtype, _, ttl, rdlength = _RECORD.unpack_from(response, offset)
+        offset += _RECORD.size + rdlength
+        if rtype != QTYPE_OPT:  # ttl field of OPT records holds flags
+            ttls.append(ttl)
+    return min(ttls, default=NEGATIVE_CACHE_TTL)
+
+
+def build_response(query: bytes, question_end: int, qtype: int, rcode: int = 0, rdata: bytes | None = None) -> bytes:
+    """Response to query with its question and an answer with rdata, if given"""
+    query_id, query_flags = struct.unpack_from("!HH", query)
+    # QR and RA set, opcode and RD copied from the query
+    flags = 0x8080 | (query_flags & 0x7900) | rcode
+    response = _HEADER.pack(query_id, flags, 1, 1 if rdata is not None else 0, 0, 0)
+    response += query[_HEADER.size : question_end]
+    if rdata is not None:
+        response += b"\xc0\x0c" + _RECORD.pack(qtype, 1, BLOCKED_TTL, len(rdata)) + rdata  # name points at question
+    return response
+
+
+class _UpstreamQuery(asyncio.DatagramProtocol):
+    def __init__(self, query: bytes):
+        self.query = query
+        self.response = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+
+    def datagram_received(self, data, addr):
+        if not self.response.done() and data[:2] == self.query[:2]:
+            self.response.set_result(data)
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+class _SinkholeDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, sinkhole: "DnsSinkhole"):
+        self.sinkhole = sinkhole
+        self.transport = None
+        self.tasks = set()  # event loop only keeps weak references to tasks
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        task = asyncio.create_task(self._answer(data, addr))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _answer(self, query: bytes, addr):
+        response = await self.sinkhole.resolve(query, use_tcp=False)
+        if response is not None:
+            self.transport.sendto(response, addr)
+
+
+class DnsSinkhole:
+    """
+    Stub resolver on localhost which blocks according to the newest rule file in rules_dir. Call run() from the thread
+    it should run on and control() and stop() from any other thread
+    """
+
+    def __init__(self, rules_dir: str, upstream_resolver: str, port: int = DNS_PORT):
+        self.rules_dir = rules_dir
+        self.upstream_resolver = upstream_resolver
+        self.port = port
+
+        self.block_type = ""
+        self.filtering_enabled = False  # enabled through control(), like mitmdump
+        self.activation_time = 0.0
+        self.url_matcher = UrlMatcher.from_rules(CompiledRules())
+        self.rule_file = None
+        self.decision_cache = DecisionCache()
+        self.response_cache = OrderedDict()  # (name, type, class) -> (expiry time, response)
+        self.error = None  # OSError the sinkhole stopped with, PermissionError if it may not listen on port
+
+        self.loop = None
+        self.stop_event = None
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except OSError as e:
+            # ports below 1024 can only be listened on as root or with CAP_NET_BIND_SERVICE on Linux and macOS
+            logger.error(f"DNS sinkhole couldn't listen on port {self.port}: {e}")
+            self.error = e
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    def control(self, options: dict) -> bool:
+        """Updates options and reloads the rules on the thread of the sinkhole. Returns False if it isn't running"""
+        if self.loop is None or self.loop.is_closed():
+            return False
+        future = asyncio.run_coroutine_threadsafe(self._control(options), self.loop)
+        try:
+            future.result(CONTROL_TIMEOUT)
+        except (TimeoutError, RuntimeError):
+            return False
+        return True
+
+    async def _control(self, options: dict):
+        for name, value in options.items():
+            if name in CONTROL_OPTIONS:
+                setattr(self, name, value)
+        self.reload_rules()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: _SinkholeDatagramProtocol(self), local_addr=("127.0.0.1", self.port)
+        )
+        tcp_server = await asyncio.start_server(self._handle_tcp_client, "127.0.0.1", self.port)
+        logger.debug(f"DNS sinkhole listening on port {self.port}, forwarding to {self.upstream_resolver}")
+        try:
+            async with tcp_server:
+                await self.stop_event.wait()
+        finally:
+            transport.close()
+            if self.rule_file is not None:
+                self.rule_file.close()
+        logger.debug("DNS sinkhole has stopped")
+
+    def reload_rules(self):
+        latest_rule_file = find_latest_rule_file(self.rules_dir)
+        if latest_rule_file is None or self.rule_file is not None and latest_rule_file[0] == self.rule_file.version:
+            return
+
+        try:
+            new_rule_file = RuleFile(latest_rule_file[1])
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load rule file {latest_rule_file[1]}: {e}")
+            return
+
+        self.url_matcher = new_rule_file.matcher()
+        self.decision_cache.clear()  # cached results are of the old rules
+        if self.rule_file is not None:
+            self.rule_file.close()
+        self.rule_file = new_rule_file
+        logger.debug(f"DNS sinkhole loaded rule file version {self.rule_file.version}")
+
+    def is_blocked(self, host: str) -> bool:
+        key = (host,)
+        has_match = self.decision_cache.get(key)
+        if has_match is None:
+            decision = self.url_matcher.host_decision(host)
+            if decision == HostDecision.UNDECIDED:  # path isn't known to a resolver
+                has_match = self.url_matcher.matches(host, f"http://{host}/")
+            else:
+                has_match = decision == HostDecision.MATCH
+            self.decision_cache.put(key, has_match)
+        return self.block_type == "allowlist" and not has_match or self.block_type == "blocklist" and has_match
+
+    async def resolve(self, query: bytes, use_tcp: bool) -> bytes | None:
+        """Response to query, None if query is too malformed to be answered"""
+        try:
+            name, qtype, qclass, question_end = parse_question(query)
+        except ValueError as e:
+            logger.debug(f"DNS sinkhole dropped a query: {e}")
+            return None
+
+        if self.filtering_enabled and name and self.is_blocked(name):
+            if qtype == QTYPE_A:
+                return build_response(query, question_end, qtype, rdata=bytes(4))
+            if qtype == QTYPE_AAAA:
+                return build_response(query, question_end, qtype, rdata=bytes(16))
+            return build_response(query, question_end, qtype, rcode=RCODE_NXDOMAIN)
+
+        key = (name, qtype, qclass)
+        cached = self.response_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.response_cache.move_to_end(key)
+            return query[:2] + cached[1][2:]  # id of the response has to be the one of the query
+
+        try:
+            response = await asyncio.wait_for(self._forward(query, use_tcp), UPSTREAM_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"DNS sinkhole couldn't reach upstream resolver {self.upstream_resolver}: {e}")
+            return build_response(query, question_end, qtype, rcode=RCODE_SERVFAIL)
+
+        try:
+            ttl = min(min_ttl(response), MAX_CACHE_TTL)
+        except (IndexError, struct.error):
+            ttl = 0
+        if ttl > 0:
+            self.response_cache[key] = (time.monotonic() + ttl, response)
+            self.response_cache.move_to_end(key)
+            if len(self.response_cache) > RESPONSE_CACHE_SIZE:
+                self.response_cache.popitem(last=False)
+        return response
+
+    async def _forward(self, query: bytes, use_tcp: bool) -> bytes:
+        if use_tcp:
+            reader, writer = await asyncio.open_connection(self.upstream_resolver, DNS_PORT)
+            try:
+                writer.write(struct.pack("!H", len(query)) + query)
+                await writer.drain()
+                (length,) = struct.unpack("!H", await reader.readexactly(2))
+                return await reader.readexactly(length)
+            finally:
+                writer.close()
+
+        transport, protocol = await self.loop.create_datagram_endpoint(
+            lambda: _UpstreamQuery(query), remote_addr=(self.upstream_resolver, DNS_PORT)
+        )
+        try:
+            return await protocol.response
+        finally:
+            transport.close()
+
+    async def _handle_tcp_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    (length,) = struct.unpack("!H", await reader.readexactly(2))
+                    query = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    return
+                response = await self.resolve(query, use_tcp=True)
+                if response is None:
+                    return
+                writer.write(struct.pack("!H", len(response)) + response)
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logger.debug(f"DNS sinkhole connection failed: {e}")
+        finally:
+            writer.close()
+
+
+def _run(command: list[str]) -> str:
+    return subprocess.run(command, check=True, capture_output=True, text=True).stdout
+
+
+def _macos_network_services() -> list[str]:
+    # first line is an explanation and disabled services start with an asterisk
+    lines = _run(["networksetup", "-listallnetworkservices"]).splitlines()[1:]
+    return [line for line in lines if line and not line.startswith("*")]
+
+
+def _windows_connected_interfaces() -> list[str]:
+    interfaces = []
+    for line in _run(["netsh", "interface", "show", "interface"]).splitlines():
+        columns = line.split(None, 3)  # admin state, state, type, name
+        if len(columns) == 4 and columns[1] == "Connected":
+            interfaces.append(columns[3])
+    return interfaces
+
+
+def _windows_show_dns_servers(interface: str) -> str:
+    return _run(["netsh", "interface", "ipv4", "show", "dnsservers", f"name={interface}"])
+
+
+def _linux_default_route_links() -> list[str]:
+    return re.findall(r"\bdev (\S+)", _run(["ip", "route", "show", "default"]))
+
+
+def _nameservers_in(text: str, include_loopback: bool = False) -> list[str]:
+    """
+    IP addresses in text. Loopback addresses are left out by default, so that queries aren't sent back to the sinkhole
+    itself or to a local stub resolver like the one of systemd-resolved
+    """
+    servers = []
+    for token in re.split(r"[\s,]+", text):
+        try:
+            is_loopback = ipaddress.ip_address(token.split("%", 1)[0]).is_loopback
+        except ValueError:
+            continue
+        if (include_loopback or not is_loopback) and token not in servers:
+            servers.append(token)
+    return servers
+
+
+def _resolv_conf_nameservers(path: str) -> list[str]:
+    try:
+        with open(path) as f:
+            return _nameservers_in(" ".join(re.findall(r"^\s*nameserver\s+(\S+)", f.read(), re.MULTILINE)))
+    except OSError:
+        return []
+
+
+def detect_upstream_resolvers() -> list[str]:
+    """DNS servers the system is using right now, empty if none of them could be found"""
+    system = platform.system()
+    try:
+        if system == "Windows":
+            return _nameservers_in(
+                "\n".join(_windows_show_dns_servers(interface) for interface in _windows_connected_interfaces())
+            )
+        if system == "Linux":
+            # /etc/resolv.conf only lists the stub resolver of systemd-resolved, which is the one being replaced
+            if shutil.which("resolvectl") and (servers := _nameservers_in(_run(["resolvectl", "dns"]))):
+                return servers
+            if servers := _resolv_conf_nameservers("/run/systemd/resolve/resolv.conf"):
+                return servers
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Couldn't look up the DNS servers of the system: {e}")
+        if system == "Windows":
+            return []
+    return _resolv_conf_nameservers("/etc/resolv.conf")
+
+
+def set_system_dns(address: str) -> dict:
+    """
+    Points the resolvers of the system at address. Returns what is needed by restore_system_dns() to undo it, raises
+    RuntimeError if the system isn't supported. If changing one of the interfaces fails, the ones changed already are
+    restored before the error is raised
+    """
+    system = platform.system()
+    previous = {}
+    try:
+        if system == "Windows":
+            for interface in _windows_connected_interfaces():
+                previous[interface] = _windows_static_dns_servers(interface)
+                _set_windows_dns_servers(interface, [address])
+        elif system == "Darwin":
+            for service in _macos_network_services():
+                servers = _run(["networksetup", "-getdnsservers", service]).split()
+                # "There aren't any DNS Servers set on ..." if the servers are given by dhcp
+                previous[service] = servers if all(is_ip_address(server) for server in servers) else []
+                _run(["networksetup", "-setdnsservers", service, address])
+        elif shutil.which("resolvectl"):
+            for link in _linux_default_route_links():
+                previous[link] = None  # reverted to the configuration of the network manager
+                _run(["resolvectl", "dns", link, address])
+                _run(["resolvectl", "domain", link, "~."])  # so that the link is used for all domains
+        else:
+            raise RuntimeError("Changing the DNS servers is only supported with systemd-resolved on Linux")
+    except (OSError, subprocess.CalledProcessError):
+        restore_system_dns(previous)
+        raise
+    return previous
+
+
+def restore_system_dns(previous: dict):
+    """
+    Undoes set_system_dns() with what it returned. Every interface is restored even if restoring one of them fails, the
+    last error is raised afterwards
+    """
+    system = platform.system()
+    error = None
+    for name, servers in previous.items():
+        try:
+            if system == "Windows":
+                _set_windows_dns_servers(name, servers)
+            elif system == "Darwin":
+                _run(["networksetup", "-setdnsservers", name, *(servers or ["Empty"])])
+            else:
+                _run(["resolvectl", "revert", name])
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.error(f"Failed to restore the DNS servers of {name}: {e}")
+            error = e
+    if error is not None:
+        raise error
+
+
+def _windows_static_dns_servers(interface: str) -> list[str] | None:
+    """Statically configured DNS servers of interface, None if they are given by DHCP"""
+    output = _windows_show_dns_servers(interface)
+    if "DHCP" in output:
+        return None
+    return _nameservers_in(output, include_loopback=True)
+
+
+def _set_windows_dns_servers(interface: str, servers: list[str] | None):
+    """Sets static DNS servers of interface in order, None has the interface use the ones given by DHCP again"""
+    command = ["netsh", "interface", "ipv4", "set", "dnsservers", f"name={interface}"]
+    if servers is None:
+        _run([*command, "source=dhcp"])
+        return
+
+    _run([*command, "source=static", f"address={servers[0] if servers else 'none'}", "validate=no"])
+    for index, server in enumerate(servers[1:], start=2):
+        _run(
+            [
+                "netsh",
+                "interface",
+                "ipv4",
+                "add",
+                "dnsservers",
+                f"name={interface}",
+                f"address={server}",
+                f"index={index}",
+                "validate=no",
+            ]
+        )
@@ -3,20 +3,136 @@
 
 """Filter URLs according to rules."""
 
+import json
 import os
 import sys
+import time
 
 # append directory containing constants.py to path so that BLOCK_HTML_MESSAGE can be imported correctly
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from mitmproxy import ctx, http
+from mitmproxy import ctx, exceptions, http
 
-from constants import BLOCK_HTML_MESSAGE, MITMDUMP_SHUTDOWN_URL
+from constants import BLOCK_HTML_MESSAGE, MITMDUMP_CONTROL_URL, MITMDUMP_SHUTDOWN_URL, MITMDUMP_STATS_URL
+from website_blocker.rule_compiler import CompiledRules
+from website_blocker.rule_file import RuleFile, find_latest_rule_file
+from website_blocker.url_matcher import DecisionCache, HostDecision, UrlMatcher, normalize_request_host
+
+# options which can be changed through MITMDUMP_CONTROL_URL while mitmdump is running
+CONTROL_OPTIONS = {"block_type", "filtering_enabled", "activation_time"}
+LOCAL_HOSTS = {"127.0.0.1", "::1", "::ffff:127.0.0.1"}
+RULES_CHECK_INTERVAL = 1  # in seconds, how often rules_dir is checked for a new rule file
+
+# built from the newest rule file in rules_dir, so that requests don't have to parse the rules again
+url_matcher = UrlMatcher.from_rules(CompiledRules())
+rule_file = None
+rules_dir_mtime = None
+last_rules_check = 0.0
+decision_cache = DecisionCache()
+# for measuring how long it took from the start of the work session till the first blocked response
+first_block_latency = None
+first_block_activation_time = None
 
 
 def load(loader):
-    loader.add_option("addresses_str", str, "", "Concatenated addresses.")
+    loader.add_option("rules_dir", str, "", "Directory containing the compiled rule files.")
     loader.add_option("block_type", str, "", "Whitelist or blacklist.")
+    loader.add_option("filtering_enabled", bool, True, "Whether requests are filtered or let through.")
+    loader.add_option("activation_time", float, 0.0, "Unix time at which filtering was requested to be enabled.")
+
+
+def configure(updated):
+    if "rules_dir" in updated:
+        reload_rules(force=True)
+
+
+def reload_rules(force=False):
+    """
+    Maps the newest rule file in rules_dir if its version differs from the mapped one. Unless forced, rules_dir is
+    only scanned if its mtime has changed
+    """
+    global url_matcher, rule_file, rules_dir_mtime, last_rules_check
+    last_rules_check = time.monotonic()
+
+    try:
+        mtime = os.stat(ctx.options.rules_dir).st_mtime_ns
+    except OSError:
+        return
+    if mtime == rules_dir_mtime and not force:
+        return
+    rules_dir_mtime = mtime
+
+    latest_rule_file = find_latest_rule_file(ctx.options.rules_dir)
+    if latest_rule_file is None or rule_file is not None and latest_rule_file[0] == rule_file.version:
+        return
+
+    try:
+        new_rule_file = RuleFile(latest_rule_file[1])
+    except (OSError, ValueError) as e:
+        print(f"Failed to load rule file {latest_rule_file[1]}: {e}")
+        return
+
+    url_matcher = new_rule_file.matcher()
+    decision_cache.clear()  # cached results are of the old rules
+    if rule_file is not None:
+        rule_file.close()
+    rule_file = new_rule_file
+    print(f"Loaded rule file version {rule_file.version}")
+
+
+def check_rules():
+    if time.monotonic() - last_rules_check >= RULES_CHECK_INTERVAL:
+        reload_rules()
+
+
+def is_blocked(has_match: bool) -> bool:
+    block_type = ctx.options.block_type
+    return block_type == "allowlist" and not has_match or block_type == "blocklist" and has_match
+
+
+def get_host_decision(host: str) -> HostDecision:
+    key = (normalize_request_host(host),)  # can't collide with the (host, path) keys of url_matcher.cache_key()
+    decision = decision_cache.get(key)
+    if decision is None:
+        decision = url_matcher.host_decision(host)
+        decision_cache.put(key, decision)
+    return decision
+
+
+def http_connect(flow):
+    """
+    Kills CONNECT requests to hosts which are blocked no matter the path, so that their TLS doesn't have to be
+    intercepted just to block them
+    """
+    if not ctx.options.filtering_enabled:
+        return
+
+    check_rules()
+    decision = get_host_decision(flow.request.host)
+    if decision != HostDecision.UNDECIDED and is_blocked(decision == HostDecision.MATCH):
+        flow.response = http.Response.make(403, b"Blocked\n", {"Content-Type": "text/plain"})
+        log_first_block()
+
+
+def tls_clienthello(data):
+    """
+    Passes TLS connections through untouched unless a request on them could be blocked, so that only connections to
+    hosts with path or regex rules are decrypted
+    """
+    if not ctx.options.filtering_enabled:
+        data.ignore_connection = True
+        return
+
+    host = data.client_hello.sni
+    if not host and data.context.server.address:
+        host = data.context.server.address[0]
+    if not host:
+        return
+
+    check_rules()
+    decision = get_host_decision(host)
+    if decision != HostDecision.UNDECIDED and not is_blocked(decision == HostDecision.MATCH):
+        data.ignore_connection = True
 
 
 def request(flow):
@@ -32,11 +148,60 @@ def request(flow):
         ctx.master.shutdown()
         return
 
-    addresses = ctx.options.addresses_str.split(",")
-    addresses = set(addresses)
+    if flow.request.pretty_url == MITMDUMP_CONTROL_URL:
+        control(flow)
+        return
+
+    if flow.request.pretty_url == MITMDUMP_STATS_URL:
+        flow.response = http.Response.make(
+            200,
+            json.dumps({**decision_cache.stats(), "first_block_latency": first_block_latency}).encode(),
+            {"Content-Type": "application/json"}
+        )
+        return
+
+    if not ctx.options.filtering_enabled:
+        return
 
-    addresses = {address for address in addresses if address}
+    check_rules()
 
-    has_match = any(address in flow.request.pretty_url for address in addresses)
-    if ctx.options.block_type == "allowlist" and not has_match or ctx.options.block_type == "blocklist" and has_match:
+    host = flow.request.pretty_host
+    url = flow.request.pretty_url
+    key = url_matcher.cache_key(host, url)
+    has_match = decision_cache.get(key)
+    if has_match is None:
+        has_match = url_matcher.matches(host, url)
+        decision_cache.put(key, has_match)
+    if is_blocked(has_match):
         flow.response = http.Response.make(200, BLOCK_HTML_MESSAGE.encode(), {"Content-Type": "text/html"})
+        log_first_block()
+
+
+def log_first_block():
+    global first_block_latency, first_block_activation_time
+    if not ctx.options.activation_time or ctx.options.activation_time == first_block_activation_time:
+        return
+
+    first_block_activation_time = ctx.options.activation_time
+    first_block_latency = time.time() - ctx.options.activation_time
+    print(f"First blocked response {first_block_latency * 1000:.0f} ms after filtering was requested")
+
+
+def control(flow):
+    """
+    Updates options from a json object in the request body, so that rules can be changed and filtering can be enabled
+    or disabled without restarting mitmdump
+    """
+    if flow.client_conn.peername[0] not in LOCAL_HOSTS:
+        flow.response = http.Response.make(403, b"Forbidden\n", {"Content-Type": "text/plain"})
+        return
+
+    try:
+        updates = json.loads(flow.request.get_text())
+        ctx.options.update(**{name: value for name, value in updates.items() if name in CONTROL_OPTIONS})
+        reload_rules(force=True)  # rule file is written before the control request is sent
+    except (ValueError, AttributeError, exceptions.OptionsError) as e:
+        flow.response = http.Response.make(400, f"{e}\n".encode(), {"Content-Type": "text/plain"})
+        return
+
+    flow.response = http.Response.make(200, b"OK\n", {"Content-Type": "text/plain"})
@@ -0,0 +1,546 @@
+import dataclasses
+import json
+import os
+import shlex
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+
+from loguru import logger
+from PySide6.QtCore import QObject, QTimer, Signal, Slot
+
+from config_paths import filter_rules_dir
+from constants import (
+    MITMDUMP_COMMAND_LINUX,
+    MITMDUMP_COMMAND_WINDOWS,
+    MITMDUMP_CONTROL_URL,
+    MITMDUMP_SHUTDOWN_URL,
+    MitmdumpState,
+    ProxyEngine,
+    ProxyRoutingMode,
+)
+from website_blocker.asyncio_proxy import AsyncioProxy
+from website_blocker.dns_sinkhole import (
+    DNS_PORT,
+    FALLBACK_UPSTREAM_RESOLVER,
+    DnsSinkhole,
+    detect_upstream_resolvers,
+    restore_system_dns,
+    set_system_dns,
+)
+from website_blocker.pac import PacServer, build_pac_script, delete_system_autoconfig_url, set_system_autoconfig_url
+from website_blocker.rule_compiler import CompiledRules
+from website_blocker.rule_file import write_rule_file
+from website_blocker.utils import kill_process
+
+MITMDUMP_READY_TIMEOUT = 15  # in seconds, how long to wait for a started mitmdump to accept control requests
+MITMDUMP_READY_POLL_INTERVAL = 0.1  # in seconds
+MITMDUMP_SHUTDOWN_TIMEOUT = 5  # in seconds, how long to wait for mitmdump to exit after a shutdown request
+PORT_PROBE_TIMEOUT = 0.5  # in seconds
+HEALTH_CHECK_INTERVAL = 5000  # in ms
+MAX_FAILED_PROBES = 3  # consecutive failed port probes after which a running mitmdump is considered hung
+MIN_RESTART_DELAY = 1  # in seconds, doubled after every failed start up to MAX_RESTART_DELAY
+MAX_RESTART_DELAY = 60  # in seconds
+BACKOFF_RESET_AFTER = 60  # in seconds, restart delay is reset once mitmdump has stayed healthy for this long
+
+
+@dataclass(slots=True)
+class DesiredState:
+    """What the supervisor should bring mitmdump and the system proxy to"""
+
+    is_running: bool = False  # whether mitmdump should be running, filtering or on standby
+    is_filtering: bool = False
+    is_proxy_set: bool = False  # whether the system proxy should point at mitmdump
+    routing_mode: ProxyRoutingMode = ProxyRoutingMode.SYSTEM_PROXY
+    engine: ProxyEngine = ProxyEngine.MITMDUMP
+    listening_port: int | None = None
+    mitmdump_bin_path: str | None = None
+    rules: CompiledRules = field(default_factory=CompiledRules)
+    exception_rules: CompiledRules = field(default_factory=CompiledRules)
+    block_type: str = ""
+    rules_serial: int = 0  # incremented whenever rules are requested, as the rule file has to be written then
+    requested_at: float = 0.0  # unix time at which filtering was requested
+
+
+class MitmdumpSupervisor(QObject):
+    """
+    Owns mitmdump and the system proxy from a thread of its own. Requests only change the desired state, which is then
+    reconciled one transition at a time: stopped -> starting -> healthy -> stopping -> stopped. So rapid toggles between
+    work and break can't start overlapping operations and redundant requests are coalesced. A crashed or hung mitmdump
+    is restarted with exponential backoff.
+    """
+
+    stateChanged = Signal(MitmdumpState)
+    filteringStarted = Signal()
+    filteringStopped = Signal()
+    operationError = Signal(str)
+    operationWarning = Signal(str)
+    reconcileRequested = Signal()
+
+    def __init__(self, proxy):
+        super().__init__()
+        self.proxy = proxy
+
+        self._desired_lock = threading.Lock()  # guards self.desired and self._is_reconcile_pending
+        self.desired = DesiredState()
+        self._is_reconcile_pending = False
+
+        # below attributes are only used from the thread of the supervisor
+        self.state = MitmdumpState.STOPPED
+        self.mitmdump_process = None  # Popen handle, None if mitmdump wasn't started by the supervisor
+        self.asyncio_proxy = None  # used instead of mitmdump with ProxyEngine.ASYNCIO
+        self.asyncio_proxy_thread = None
+        self.dns_sinkhole = None  # used instead of mitmdump with ProxyEngine.DNS_SINKHOLE
+        self.dns_sinkhole_thread = None
+        self.engine = None
+        self.listening_port = None
+        self.applied_options = None  # options last accepted by the filter addon
+        self.applied_rules_serial = None
+        self.is_proxy_set = False
+        self.routing_mode = None  # routing mode the system proxy was set with
+        self.previous_system_dns = None  # returned by set_system_dns(), not None while the DNS sinkhole is set
+        # engine which wasn't allowed to start, it is only started again when filtering is requested and not just
+        # prewarmed, so that the same error isn't shown on every break, until the engine setting changes
+        self.denied_engine = None
+        self.pac_server = PacServer()
+        self.restart_delay = MIN_RESTART_DELAY
+        self.next_start_at = 0.0  # time.monotonic() before which mitmdump isn't started again
+        self.healthy_since = None
+        self.failed_probes = 0
+        self.health_timer = None
+        self.reconcile_timer = None
+
+        self.reconcileRequested.connect(self.reconcile)
+
+    def startTimers(self):
+        # created here so that the timers belong to the thread of the supervisor
+        self.health_timer = QTimer()
+        self.health_timer.timeout.connect(self.checkHealth)
+        self.health_timer.start(HEALTH_CHECK_INTERVAL)
+
+        self.reconcile_timer = QTimer()
+        self.reconcile_timer.setSingleShot(True)
+        self.reconcile_timer.timeout.connect(self.reconcile)
+
+    def stopTimers(self):
+        if self.health_timer is not None:
+            self.health_timer.stop()
+        if self.reconcile_timer is not None:
+            self.reconcile_timer.stop()
+
+    def stopPacServer(self):
+        self.pac_server.stop()
+
+    def request(self, new_rules: bool = False, **changes):
+        """
+        Changes the desired state and has it reconciled on the thread of the supervisor. Can be called from any thread
+        """
+        with self._desired_lock:
+            for name, value in changes.items():
+                setattr(self.desired, name, value)
+            if new_rules:
+                self.desired.rules_serial += 1
+
+            if self._is_reconcile_pending:  # pending reconcile will see these changes as well
+                return
+            self._is_reconcile_pending = True
+
+        self.reconcileRequested.emit()
+
+    @Slot()
+    def reconcile(self):
+        with self._desired_lock:
+            self._is_reconcile_pending = False
+            desired = dataclasses.replace(self.desired)
+
+        try:
+            self._reconcile(desired)
+        except Exception as e:
+            logger.error(f"Error while reconciling mitmdump state: {e}")
+            self.operationError.emit(str(e))
+            if self.state not in (MitmdumpState.HEALTHY, MitmdumpState.STOPPED):
+                # _reconcile() only goes on from HEALTHY or STOPPED, so whatever was half started or half stopped is
+                # cleaned up and started again with backoff
+                self._on_mitmdump_lost()
+
+    def _reconcile(self, desired: DesiredState):
+        # system proxy is removed first, so that no request slips through while filtering is being disabled
+        if self.is_proxy_set and (not desired.is_proxy_set or desired.routing_mode != self.routing_mode):
+            self._set_proxy(False)
+
+        if self.state == MitmdumpState.HEALTHY and (
+            not desired.is_running or desired.listening_port != self.listening_port or desired.engine != self.engine
+        ):
+            if self.is_proxy_set:
+                self._set_proxy(False)
+            self._stop()
+            self.filteringStopped.emit()
+
+        if not desired.is_running:
+            return
+
+        if desired.engine != self.denied_engine:
+            self.denied_engine = None
+        elif self.state == MitmdumpState.STOPPED and not desired.is_filtering:
+            logger.debug(f"Not prewarming {desired.engine.value}, it wasn't allowed to start")
+            return
+
+        if self.state == MitmdumpState.STOPPED and not self._start(desired):
+            return
+
+        options = {"filtering_enabled": desired.is_filtering}
+        if desired.is_filtering:
+            if desired.rules_serial != self.applied_rules_serial:
+                rules_version = write_rule_file(filter_rules_dir, desired.rules, desired.exception_rules)
+                logger.debug(
+                    f"Wrote rule file version {rules_version} with {len(desired.rules)} rules and "
+                    f"{len(desired.exception_rules)} exceptions"
+                )
+                self.applied_rules_serial = desired.rules_serial
+                self.applied_options = None  # addon has to be told to reload the rule file
+                if self.is_proxy_set and self.routing_mode == ProxyRoutingMode.PAC and self.previous_system_dns is None:
+                    self._update_pac(desired)
+            options["block_type"] = desired.block_type
+            options["activation_time"] = desired.requested_at
+
+        if options != self.applied_options:
+            if not self._send_control(self.listening_port, options):
+                self._on_mitmdump_lost()
+                return
+            was_filtering = self.applied_options is not None and self.applied_options["filtering_enabled"]
+            self.applied_options = options
+            if was_filtering and not desired.is_filtering:
+                self.filteringStopped.emit()
+
+        # system proxy is only switched over once mitmdump is filtering, so that no request slips through
+        if desired.is_proxy_set and not self.is_proxy_set:
+            self._set_proxy(True, desired)
+            if desired.is_filtering:
+                logger.info(
+                    f"Website filtering active {(time.time() - desired.requested_at) * 1000:.0f} ms after it was "
+                    f"requested"
+                )
+                self.filteringStarted.emit()
+
+    def _set_state(self, state: MitmdumpState):
+        if state == self.state:
+            return
+        logger.debug(f"mitmdump state: {self.state.value} -> {state.value}")
+        self.state = state
+        self.stateChanged.emit(state)
+
+    def _set_proxy(self, is_proxy_set: bool, desired: DesiredState | None = None):
+        if is_proxy_set:
+            self.routing_mode = desired.routing_mode
+            if self.engine == ProxyEngine.DNS_SINKHOLE:  # resolvers are pointed at the sinkhole instead of a proxy
+                self.previous_system_dns = set_system_dns("127.0.0.1")
+            elif self.routing_mode == ProxyRoutingMode.PAC:
+                self.pac_server.start()
+                self._update_pac(desired)
+            else:
+                self.proxy.join()
+        elif self.previous_system_dns is not None:
+            restore_system_dns(self.previous_system_dns)
+            self.previous_system_dns = None
+        elif self.routing_mode == ProxyRoutingMode.PAC:
+            delete_system_autoconfig_url()
+        else:
+            self.proxy.delete_proxy()
+        self.is_proxy_set = is_proxy_set
+
+    def _update_pac(self, desired: DesiredState):
+        """Serves a PAC script of the desired rules and points the system at it"""
+        self.pac_server.set_script(
+            build_pac_script(
+                desired.rules, desired.exception_rules, desired.block_type, "127.0.0.1", self.listening_port
+            )
+        )
+        set_system_autoconfig_url(self.pac_server.url())
+
+    def _start(self, desired: DesiredState) -> bool:
+        """Starts mitmdump and waits until it is ready. Returns False if it didn't become ready"""
+        now = time.monotonic()
+        if now < self.next_start_at:  # still backing off after a failed start
+            self.reconcile_timer.start(int((self.next_start_at - now) * 1000))
+            return False
+
+        self._set_state(MitmdumpState.STARTING)
+        self.listening_port = desired.listening_port
+        self.engine = desired.engine
+        self.applied_options = None
+
+        try:
+            if self._adopt_or_start(desired):
+                self._on_started()
+                return True
+        except urllib.error.HTTPError as e:
+            # something listening on the port answered the control request, but it isn't a proxy with the filter addon
+            logger.error(f"Port {self.listening_port} is used by another proxy: {e}")
+            self.operationError.emit(
+                f"Failed to start filtering: port {self.listening_port} is used by another program. Choose another "
+                f"proxy port in the settings"
+            )
+            self._on_mitmdump_lost()
+            return False
+
+        if self.dns_sinkhole is not None and isinstance(self.dns_sinkhole.error, PermissionError):
+            # restarting won't change the permissions, so the sinkhole is given up until filtering is requested again
+            self.denied_engine = self.engine
+            self.operationError.emit(
+                f"Failed to start filtering: the DNS sinkhole isn't allowed to listen on port {DNS_PORT}. Run "
+                f"Koncentro with administrator rights or choose another filtering engine in the settings"
+            )
+            self._on_mitmdump_lost(restart=False)
+            self.request(is_running=False, is_filtering=False, is_proxy_set=False)
+            return False
+
+        self.operationError.emit("Failed to start filtering: mitmdump didn't start")
+        self._on_mitmdump_lost()
+        return False
+
+    def _adopt_or_start(self, desired: DesiredState) -> bool:
+        """
+        Adopts the proxy already listening on the port or starts one and waits until it is ready. Returns False if it
+        didn't become ready, raises HTTPError if something else on the port rejects the control request
+        """
+        # mitmdump can already be running, for example when it was left running by a crashed instance of the app
+        if self._probe() and self._send_control(self.listening_port, {}):
+            logger.debug("Adopting mitmdump which is already running")
+            return True
+
+        logger.debug(f"Starting {self.engine.value} proxy")
+        started_at = time.monotonic()
+        if self.engine == ProxyEngine.ASYNCIO:
+            self._start_asyncio_proxy(self.listening_port)
+        elif self.engine == ProxyEngine.DNS_SINKHOLE:
+            self._start_dns_sinkhole()
+        else:
+            self._start_mitmdump(self.listening_port, desired.mitmdump_bin_path)
+        while time.monotonic() - started_at < MITMDUMP_READY_TIMEOUT:
+            time.sleep(MITMDUMP_READY_POLL_INTERVAL)
+            if self._has_exited():
+                logger.error(f"{self.engine.value} proxy exited while starting")
+                return False
+            if self._probe() and self._send_control(self.listening_port, {}):
+                logger.debug(f"mitmdump became ready in {(time.monotonic() - started_at) * 1000:.0f} ms")
+                return True
+
+        logger.error(f"mitmdump didn't become ready within {MITMDUMP_READY_TIMEOUT} seconds")
+        return False
+
+    def _on_started(self):
+        self.healthy_since = time.monotonic()
+        self.failed_probes = 0
+        self._set_state(MitmdumpState.HEALTHY)
+
+    def _stop(self):
+        self._set_state(MitmdumpState.STOPPING)
+        if not self._shutdown_mitmdump(self.listening_port):
+            self.operationError.emit("Warning during filtering shutdown: mitmdump had to be killed")
+        self.listening_port = None
+        self.applied_options = None
+        self._set_state(MitmdumpState.STOPPED)
+
+    def _on_mitmdump_lost(self, restart: bool = True):
+        """Cleans up after mitmdump has crashed or failed to start and schedules a restart with backoff if restart"""
+        if self.is_proxy_set:
+            # removed so that the machine isn't left without network access while mitmdump is being restarted
+            try:
+                self._set_proxy(False)
+            except Exception as e:  # cleanup goes on, the proxy is set again the next time filtering starts
+                logger.error(f"Failed to remove the system proxy: {e}")
+                self.operationError.emit(f"Failed to remove the system proxy: {e}")
+                self.is_proxy_set = False
+                self.previous_system_dns = None
+        if self.mitmdump_process is not None:
+            kill_process(self.mitmdump_process)
+            self.mitmdump_process = None
+        if self.asyncio_proxy is not None:
+            self._stop_asyncio_proxy()
+        if self.dns_sinkhole is not None:
+            self._stop_dns_sinkhole()
+        self.applied_options = None
+        self._set_state(MitmdumpState.STOPPED)
+        if not restart:
+            return
+
+        delay = self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+        self.next_start_at = time.monotonic() + delay
+        logger.info(f"Restarting mitmdump in {delay} seconds")
+        self.reconcile_timer.start(delay * 1000)
+
+    def checkHealth(self):
+        if self.state != MitmdumpState.HEALTHY:
+            return
+
+        has_exited = self._has_exited()
+        if not has_exited:
+            if self._probe():
+                self.failed_probes = 0
+                if time.monotonic() - self.healthy_since >= BACKOFF_RESET_AFTER:
+                    self.restart_delay = MIN_RESTART_DELAY
+                return
+
+            self.failed_probes += 1
+            logger.debug(f"mitmdump isn't accepting connections, failed probes: {self.failed_probes}")
+            if self.failed_probes < MAX_FAILED_PROBES:
+                return
+
+        logger.error("mitmdump has exited" if has_exited else "mitmdump has stopped accepting connections")
+        self._on_mitmdump_lost()
+
+    def _has_exited(self) -> bool:
+        """Whether the proxy started by the supervisor has exited"""
+        if self.mitmdump_process is not None:
+            return self.mitmdump_process.poll() is not None
+        if self.asyncio_proxy_thread is not None:
+            return not self.asyncio_proxy_thread.is_alive()
+        if self.dns_sinkhole_thread is not None:
+            return not self.dns_sinkhole_thread.is_alive()
+        return False
+
+    def _probe(self) -> bool:
+        # DNS sinkhole answers queries over tcp as well, so its port can be probed the same way
+        return self._probe_port(DNS_PORT if self.engine == ProxyEngine.DNS_SINKHOLE else self.listening_port)
+
+    @staticmethod
+    def _probe_port(listening_port) -> bool:
+        try:
+            with socket.create_connection(("127.0.0.1", listening_port), timeout=PORT_PROBE_TIMEOUT):
+                return True
+        except OSError:
+            return False
+
+    def _send_control(self, listening_port, options: dict) -> bool:
+        """
+        Sends options to the filter addon of mitmdump through the proxy. Returns False if mitmdump isn't listening on
+        listening_port
+        """
+        if self.engine == ProxyEngine.DNS_SINKHOLE:  # runs in this process, so it is controlled directly
+            return self.dns_sinkhole is not None and self.dns_sinkhole.control(options)
+
+        request = urllib.request.Request(
+            MITMDUMP_CONTROL_URL,
+            data=json.dumps(options).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        return self._send_internal_request(listening_port, request)
+
+    def _send_internal_request(self, listening_port, request: urllib.request.Request) -> bool:
+        """
+        Sends a request for one of the internal URLs of the filter addon through the proxy, from this process instead
+        of spawning an HTTP client. Returns False if mitmdump isn't listening on listening_port
+        """
+        opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({"http": f"http://127.0.0.1:{listening_port}"})
+        )
+        try:
+            with opener.open(request, timeout=2) as response:
+                return response.status == 200
+        except urllib.error.HTTPError:
+            raise  # mitmdump is running but rejected the request
+        except (urllib.error.URLError, OSError) as e:
+            logger.debug(f"Couldn't reach mitmdump on port {listening_port}: {e}")
+            return False
+
+    def _start_mitmdump(self, listening_port, mitmdump_bin_path):
+        """
+        Starts mitmdump with filtering disabled, filtering is enabled through a control request once it is ready
+        """
+        # Prepare command arguments
+        if os.name == "nt":
+            args = shlex.split(MITMDUMP_COMMAND_WINDOWS.format(mitmdump_bin_path, listening_port), posix=False)
+        else:
+            args = shlex.split(MITMDUMP_COMMAND_LINUX.format(mitmdump_bin_path, listening_port))
+        # appended separately as settings dir can contain spaces, which shlex.split() with posix=False doesn't unquote
+        args += ["--set", f"rules_dir={filter_rules_dir}", "--set", "filtering_enabled=false"]
+
+        # Start the process, handle is kept so that it can be stopped without looking for it among all processes
+        self.mitmdump_process = subprocess.Popen(args)
+
+    def _start_asyncio_proxy(self, listening_port):
+        """Starts the asyncio proxy on a thread of its own with filtering disabled, like mitmdump"""
+        self.asyncio_proxy = AsyncioProxy(listening_port, filter_rules_dir)
+        self.asyncio_proxy_thread = threading.Thread(target=self.asyncio_proxy.run, name="AsyncioProxy", daemon=True)
+        self.asyncio_proxy_thread.start()
+
+    def _stop_asyncio_proxy(self) -> bool:
+        """Stops the asyncio proxy if its shutdown request didn't. Returns False if its thread didn't exit in time"""
+        proxy, thread = self.asyncio_proxy, self.asyncio_proxy_thread
+        self.asyncio_proxy, self.asyncio_proxy_thread = None, None
+        proxy.stop()
+        thread.join(MITMDUMP_SHUTDOWN_TIMEOUT)
+        return not thread.is_alive()
+
+    def _start_dns_sinkhole(self):
+        """Starts the DNS sinkhole on a thread of its own with filtering disabled, like mitmdump"""
+        # detected before the resolvers of the system are pointed at the sinkhole itself
+        upstream_resolvers = detect_upstream_resolvers()
+        if upstream_resolvers:
+            upstream_resolver = upstream_resolvers[0]
+        else:
+            upstream_resolver = FALLBACK_UPSTREAM_RESOLVER
+            logger.warning(f"No DNS servers of the system found, falling back to {upstream_resolver}")
+            self.operationWarning.emit(
+                f"Couldn't find the DNS servers of the system, so websites are looked up through {upstream_resolver} "
+                f"while filtering. Names only known to a VPN or the local network won't resolve"
+            )
+        self.dns_sinkhole = DnsSinkhole(filter_rules_dir, upstream_resolver)
+        self.dns_sinkhole_thread = threading.Thread(target=self.dns_sinkhole.run, name="DnsSinkhole", daemon=True)
+        self.dns_sinkhole_thread.start()
+
+    def _stop_dns_sinkhole(self) -> bool:
+        """Stops the DNS sinkhole. Returns False if its thread didn't exit in time"""
+        sinkhole, thread = self.dns_sinkhole, self.dns_sinkhole_thread
+        self.dns_sinkhole, self.dns_sinkhole_thread = None, None
+        sinkhole.stop()
+        thread.join(MITMDUMP_SHUTDOWN_TIMEOUT)
+        return not thread.is_alive()
+
+    def _shutdown_mitmdump(self, listening_port) -> bool:
+        """
+        Asks the filter addon to shut down and falls back to stopping the started process through its handle if that
+        doesn't work. Returns False if mitmdump had to be killed
+        """
+        if self.dns_sinkhole is not None:  # isn't a proxy, so it can't be sent the shutdown request
+            return self._stop_dns_sinkhole()
+
+        process, self.mitmdump_process = self.mitmdump_process, None
+
+        try:
+            is_shutdown_requested = self._send_internal_request(
+                listening_port, urllib.request.Request(MITMDUMP_SHUTDOWN_URL)
+            )
+        except urllib.error.HTTPError as e:
+            logger.error(f"Graceful shutdown of mitmdump failed: {e}")
+            is_shutdown_requested = False
+
+        if not is_shutdown_requested:
+            logger.debug("Most likely mitmproxy/mitmdump isn't running")
+
+        if self.asyncio_proxy is not None:
+            return self._stop_asyncio_proxy()
+
+        if process is None:  # not started by the supervisor, nothing more can be done
+            return True
+
+        if is_shutdown_requested:
+            try:
+                process.wait(MITMDUMP_SHUTDOWN_TIMEOUT)
+                return True
+            except subprocess.TimeoutExpired:
+                logger.error(f"mitmdump didn't exit within {MITMDUMP_SHUTDOWN_TIMEOUT} seconds of shutdown request")
+
+        if process.poll() is not None:  # had already exited
+            return True
+
+        # Fall back to stopping the exact process if graceful shutdown fails
+        logger.info(f"Falling back to stopping mitmdump through its pid {process.pid}.")
+        kill_process(process)
+        return False
@@ -0,0 +1,214 @@
+"""
+Proxy auto-config (PAC) routing of the website filter. Instead of sending all traffic of the machine through mitmdump,
+the system is pointed at a PAC script which routes only the hosts that rules can apply to through mitmdump and
+everything else DIRECT.
+"""
+
+import json
+import platform
+import shutil
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from website_blocker.rule_compiler import CompiledRules
+
+PAC_PATH = "/proxy.pac"
+
+# hosts in HOSTS and their subdomains are routed to MATCHED, the rest to OTHERS. EXCEPTIONS are always proxied, as
+# exception rules can only be applied by mitmdump
+_PAC_TEMPLATE = """var EXCEPTIONS = {exceptions};
+var HOSTS = {hosts};
+
+function isListed(hosts, host) {{
+    while (true) {{
+        if (Object.prototype.hasOwnProperty.call(hosts, host)) {{
+            return true;
+        }}
+        var dot = host.indexOf(".");
+        if (dot == -1) {{
+            return false;
+        }}
+        host = host.substring(dot + 1);
+    }}
+}}
+
+function FindProxyForURL(url, host) {{
+    host = host.toLowerCase();
+    if (isListed(EXCEPTIONS, host)) {{
+        return "{proxy}";
+    }}
+    return isListed(HOSTS, host) ? "{matched}" : "{others}";
+}}
+"""
+
+
+def _hosts_of(rules: CompiledRules, with_path_hosts: bool) -> set:
+    hosts = rules.exact_hosts | rules.wildcard_hosts
+    if with_path_hosts:
+        hosts |= {host for host, _ in rules.path_prefixes}
+    return hosts
+
+
+def build_pac_script(
+    rules: CompiledRules, exception_rules: CompiledRules, block_type: str, proxy_host: str, proxy_port: int
+) -> str:
+    """
+    Builds a PAC script which routes every host that could be blocked through the proxy. Regexes can match any host,
+    so with them in a blocklist everything is proxied
+    """
+    proxy = f"PROXY {proxy_host}:{proxy_port}"
+
+    if block_type == "allowlist":
+        # hosts allowed no matter the path can go DIRECT, unless an exception could block some of their URLs
+        hosts = set() if exception_rules.regexes else _hosts_of(rules, with_path_hosts=False)
+        exceptions = _hosts_of(exception_rules, with_path_hosts=True)
+        matched, others = "DIRECT", proxy
+    else:
+        hosts = _hosts_of(rules, with_path_hosts=True)
+        exceptions = set()  # exceptions only narrow down what is blocked, so they don't have to be proxied
+        matched, others = proxy, proxy if rules.regexes else "DIRECT"
+
+    return _PAC_TEMPLATE.format(
+        exceptions=json.dumps(dict.fromkeys(sorted(exceptions), 1)),
+        hosts=json.dumps(dict.fromkeys(sorted(hosts), 1)),
+        proxy=proxy,
+        matched=matched,
+        others=others,
+    )
+
+
+class PacServer:
+    """Serves the current PAC script over http on localhost from a thread of its own"""
+
+    def __init__(self):
+        self.script = b""
+        self.version = 0  # part of the url, so that the system fetches the script again after it changed
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self._server is not None:
+            return
+
+        pac_server = self
+
+        class PacRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != PAC_PATH:
+                    self.send_error(404)
+                    return
+                script = pac_server.script
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ns-proxy-autoconfig")
+                self.send_header("Content-Length", str(len(script)))
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                self.wfile.write(script)
+
+            def log_message(self, format, *args):
+                pass  # requests for the script aren't worth logging
+
+        # port is picked by the system, as the url is set again every time filtering starts anyways
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), PacRequestHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="PacServer", daemon=True)
+        self._thread.start()
+        logger.debug(f"PAC server listening on port {self._server.server_address[1]}")
+
+    def set_script(self, script: str):
+        self.script = script.encode()
+        self.version += 1
+
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}{PAC_PATH}?v={self.version}"
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+
+def _run(command: list[str]) -> str:
+    return subprocess.run(command, check=True, capture_output=True, text=True).stdout
+
+
+def _macos_network_services() -> list[str]:
+    # first line is an explanation and disabled services start with an asterisk
+    lines = _run(["networksetup", "-listallnetworkservices"]).splitlines()[1:]
+    return [line for line in lines if line and not line.startswith("*")]
+
+
+def _set_kde_proxy_setting(key: str, value: str):
+    kde_config_command = shutil.which("kwriteconfig6") or shutil.which("kwriteconfig5")
+    if kde_config_command:
+        _run([kde_config_command, "--file", "kioslaverc", "--group", "Proxy Settings", "--key", key, value])
+
+
+def set_system_autoconfig_url(url: str):
+    """Points the system proxy settings at the PAC script at url"""
+    system = platform.system()
+    if system == "Windows":
+        import winreg
+
+        with winreg.OpenKey(
+            winreg.HKEY_CURRENT_USER,
+            r"Software\Microsoft\Windows\CurrentVersion\Internet Settings",
+            0,
+            winreg.KEY_SET_VALUE,
+        ) as key:
+            winreg.SetValueEx(key, "AutoConfigURL", 0, winreg.REG_SZ, url)
+        _refresh_windows_internet_settings()
+    elif system == "Darwin":
+        for service in _macos_network_services():
+            _run(["networksetup", "-setautoproxyurl", service, url])
+            _run(["networksetup", "-setautoproxystate", service, "on"])
+    else:
+        if shutil.which("gsettings"):
+            _run(["gsettings", "set", "org.gnome.system.proxy", "autoconfig-url", url])
+            _run(["gsettings", "set", "org.gnome.system.proxy", "mode", "auto"])
+        _set_kde_proxy_setting("Proxy Config Script", url)
+        _set_kde_proxy_setting("ProxyType", "2")  # use proxy auto-config
+
+
+def delete_system_autoconfig_url():
+    """Removes the PAC script from the system proxy settings"""
+    system = platform.system()
+    if system == "Windows":
+        import winreg
+
+        with winreg.OpenKey(
+            winreg.HKEY_CURRENT_USER,
+            r"Software\Microsoft\Windows\CurrentVersion\Internet Settings",
+            0,
+            winreg.KEY_SET_VALUE,
+        ) as key:
+            try:
+                winreg.DeleteValue(key, "AutoConfigURL")
+            except FileNotFoundError:
+                pass
+        _refresh_windows_internet_settings()
+    elif system == "Darwin":
+        for service in _macos_network_services():
+            _run(["networksetup", "-setautoproxystate", service, "off"])
+    else:
+        if shutil.which("gsettings"):
+            _run(["gsettings", "set", "org.gnome.system.proxy", "mode", "none"])
+        _set_kde_proxy_setting("ProxyType", "0")  # no proxy
+
+
+def _refresh_windows_internet_settings():
+    """Tells running applications that the internet settings have changed, otherwise they keep using the old ones"""
+    import ctypes
+
+    INTERNET_OPTION_SETTINGS_CHANGED = 39
+    INTERNET_OPTION_REFRESH = 37
+    internet_set_option = ctypes.windll.wininet.InternetSetOptionW
+    internet_set_option(None, INTERNET_OPTION_SETTINGS_CHANGED, None, 0)
+    internet_set_option(None, INTERNET_OPTION_REFRESH, None, 0)
@@ -0,0 +1,173 @@
+"""
+Compiles the URL lists of the website filter into normalized and deduplicated rules. Each address is one of:
+
+    exact host            an IP address like "192.168.1.1", matches only that host
+    subdomain wildcard    a domain like "example.com" or "*.example.com", matches it and all of its subdomains
+    path prefix           a domain or IP with a path like "example.com/news", matches URLs of that host and its
+                          subdomains whose path is "/news" or starts with "/news/"
+    regex                 a pattern between slashes like "/example\\.(com|org)/", searched for in the URL without
+                          its scheme
+    URL with a query      an address like "youtube.com/watch?v=abc", compiled into a regex matching URLs of that host
+                          and its subdomains with that path whose query starts with "v=abc", as a path prefix would
+                          match every URL of the path
+
+Scheme, port, trailing dots and trailing slashes are dropped and hosts are lowercased and IDNA encoded, so that
+"https://Example.com/" and "example.com" end up as the same rule.
+"""
+
+import ipaddress
+import re
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Iterable
+
+
+class RuleType(Enum):
+    EXACT_HOST = "exact_host"
+    SUBDOMAIN_WILDCARD = "subdomain_wildcard"
+    PATH_PREFIX = "path_prefix"
+    REGEX = "regex"
+
+
+@dataclass(slots=True)
+class CompiledRules:
+    exact_hosts: set = field(default_factory=set)
+    wildcard_hosts: set = field(default_factory=set)
+    path_prefixes: set = field(default_factory=set)  # (host, path prefix) tuples
+    regexes: set = field(default_factory=set)
+
+    def __len__(self):
+        return len(self.exact_hosts) + len(self.wildcard_hosts) + len(self.path_prefixes) + len(self.regexes)
+
+    def max_path_segments(self) -> int:
+        """Number of path segments in the longest path prefix, URLs need to be looked at only this deep"""
+        return max((path_prefix.count("/") for _, path_prefix in self.path_prefixes), default=0)
+
+
+def normalize_host(host: str) -> str:
+    """Lowercases and IDNA encodes host and drops its trailing dot, raises ValueError if host isn't valid"""
+    host = host.strip().lower().rstrip(".")
+    if not host or any(not label for label in host.split(".")):
+        raise ValueError(f"Invalid host: {host!r}")
+
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError as e:
+            raise ValueError(f"Invalid host: {host!r}") from e
+    return host
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+def is_regex_address(address: str) -> bool:
+    """Whether address is a pattern between slashes"""
+    address = address.strip()
+    return len(address) > 2 and address.startswith("/") and address.endswith("/")
+
+
+def _query_url_pattern(host: str, path: str, query: str) -> str:
+    """
+    Regex matching URLs of host, and of its subdomains unless it is an IP address, whose path is path and whose query
+    starts with query. Path and query are matched case sensitively, unlike the host
+    """
+    if is_ip_address(host):
+        host_pattern = re.escape(f"[{host}]" if ":" in host else host)
+    else:
+        host_pattern = rf"(?:[^/?#@]*\.)?{re.escape(host)}"
+    return rf"^{host_pattern}(?::\d+)?(?-i:{re.escape(path)})/?\?(?-i:{re.escape(query)})(?:[&#]|$)"
+
+
+def compile_rule(address: str) -> tuple[RuleType, str | tuple[str, str]]:
+    """Classifies and normalizes a single address, raises ValueError if it can't be compiled"""
+    address = address.strip()
+
+    if is_regex_address(address):
+        pattern = address[1:-1]
+        try:
+            re.compile(pattern)
+        except re.error as e:  # re.error isn't a subclass of ValueError
+            raise ValueError(f"Invalid regex {pattern!r}: {e}") from e
+        return RuleType.REGEX, pattern
+
+    address = address.split("://", 1)[-1]  # scheme doesn't matter for matching
+    address, _, query = address.split("#", 1)[0].partition("?")
+    authority, _, path = address.partition("/")
+    host = authority.rsplit("@", 1)[-1]  # drop user info
+    if host.startswith("["):  # IPv6 address, can contain colons
+        host = host[: host.find("]") + 1]
+    else:
+        host = host.split(":", 1)[0]  # drop port
+
+    is_wildcard = host.startswith("*.")
+    host = normalize_host(host.removeprefix("*."))
+    if is_ip_address(host):
+        if is_wildcard:
+            raise ValueError(f"IP address {host} can't have subdomains")
+        host = host.strip("[]")
+
+    path = path.rstrip("/")
+    if query:
+        return RuleType.REGEX, _query_url_pattern(host, f"/{path}" if path else "", query)
+    if path:
+        return RuleType.PATH_PREFIX, (host, f"/{path}")
+    if is_ip_address(host):
+        return RuleType.EXACT_HOST, host
+    return RuleType.SUBDOMAIN_WILDCARD, host
+
+
+def _is_covered_by_wildcard(host: str, wildcard_hosts: set) -> bool:
+    """Whether host or one of its parent domains is in wildcard_hosts"""
+    labels = host.split(".")
+    return any(".".join(labels[i:]) in wildcard_hosts for i in range(len(labels)))
+
+
+def compile_rules(addresses: Iterable[str]) -> CompiledRules:
+    """
+    Compiles addresses into deduplicated rules, dropping the ones which are already covered by a broader rule. Invalid
+    addresses are skipped, use compile_rule() to validate them beforehand
+    """
+    rules = CompiledRules()
+    for address in addresses:
+        if not address.strip():
+            continue
+        try:
+            rule_type, rule = compile_rule(address)
+        except ValueError:
+            continue
+
+        if rule_type == RuleType.EXACT_HOST:
+            rules.exact_hosts.add(rule)
+        elif rule_type == RuleType.SUBDOMAIN_WILDCARD:
+            rules.wildcard_hosts.add(rule)
+        elif rule_type == RuleType.PATH_PREFIX:
+            rules.path_prefixes.add(rule)
+        elif rule_type == RuleType.REGEX:
+            rules.regexes.add(rule)
+
+    # "a.example.com" is redundant next to "example.com", so is "example.com/news"
+    rules.wildcard_hosts = {
+        host
+        for host in rules.wildcard_hosts
+        if "." not in host or not _is_covered_by_wildcard(host.split(".", 1)[1], rules.wildcard_hosts)
+    }
+    rules.path_prefixes = {
+        (host, path_prefix)
+        for host, path_prefix in rules.path_prefixes
+        if host not in rules.exact_hosts and not _is_covered_by_wildcard(host, rules.wildcard_hosts)
+    }
+    # "example.com/news/world" is redundant next to "example.com/news"
+    rules.path_prefixes = {
+        (host, path_prefix)
+        for host, path_prefix in rules.path_prefixes
+        if not any(
+            (host, path_prefix[:i]) in rules.path_prefixes for i in range(1, len(path_prefix)) if path_prefix[i] == "/"
+        )
+    }
+    return rules
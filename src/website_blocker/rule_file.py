@@ -0,0 +1,189 @@
+"""
+Compiled rule files of the website filter. WebsiteBlockerManager writes every version of the rule set to its own
+file in a rules directory and the filter addon of mitmdump maps the newest one into memory, so that the URL list
+doesn't have to go through the command line of mitmdump and can have hundreds of thousands of entries.
+
+Layout of a rule file, all integers are little endian:
+
+    header: magic (4s) | format version (u16) | max path segments (u16) | exception max path segments (u16) |
+            rule set version (u64) | 5 section counts of the rules (u32) | 5 section counts of the exceptions (u32)
+    offsets: (total count + 1) * u32, offsets of the entries relative to the start of data
+    data: utf-8 encoded entries of each section in the order of the counts, each section sorted. Entries are in the
+          form looked up by UrlMatcher: exact hosts, reversed wildcard hosts, path_prefix_key() of reversed hosts and
+          path prefixes, reversed hosts having path prefixes, and regexes. The exception list follows the rules in the
+          same five sections
+
+Sections are binary searched right inside of the mapped file, so loading a rule file costs nothing no matter its size.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+from website_blocker.rule_compiler import CompiledRules
+from website_blocker.url_matcher import UrlMatcher, path_prefix_key, reverse_host
+
+MAGIC = b"KRUL"
+FORMAT_VERSION = 4
+RULE_FILE_EXTENSION = ".rules"
+
+_HEADER = struct.Struct("<4sHHHQ10I")
+_OFFSET = struct.Struct("<I")
+
+
+def rule_file_name(version: int) -> str:
+    return f"{version}{RULE_FILE_EXTENSION}"
+
+
+def _sections(rules: CompiledRules) -> list[list[bytes]]:
+    return [
+        sorted(host.encode() for host in rules.exact_hosts),
+        sorted(reverse_host(host).encode() for host in rules.wildcard_hosts),
+        sorted(path_prefix_key(reverse_host(host), path_prefix).encode() for host, path_prefix in rules.path_prefixes),
+        sorted({reverse_host(host).encode() for host, _ in rules.path_prefixes}),
+        sorted(regex.encode() for regex in rules.regexes),
+    ]
+
+
+def write_rule_file(rules_dir: str, rules: CompiledRules, exception_rules: CompiledRules | None = None) -> int:
+    """
+    Writes rules and their exceptions as a new version of the rule file in rules_dir and returns its version. Older
+    versions are removed, unless they are still mapped by mitmdump on Windows in which case they are removed on the
+    next write.
+    """
+    os.makedirs(rules_dir, exist_ok=True)
+    if exception_rules is None:
+        exception_rules = CompiledRules()
+
+    sections = _sections(rules) + _sections(exception_rules)
+    entries = [entry for section in sections for entry in section]
+
+    offsets = [0]
+    for entry in entries:
+        offsets.append(offsets[-1] + len(entry))
+
+    # versions only have to increase, they are also used as file names
+    version = max([time.time_ns(), *(version + 1 for version, _ in _list_rule_files(rules_dir))])
+
+    path = os.path.join(rules_dir, rule_file_name(version))
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(
+            _HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                rules.max_path_segments(),
+                exception_rules.max_path_segments(),
+                version,
+                *(len(section) for section in sections),
+            )
+        )
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(entries))
+    os.replace(temp_path, path)  # addon never sees a partially written file
+
+    for old_version, old_path in _list_rule_files(rules_dir):
+        if old_version < version:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    return version
+
+
+def _list_rule_files(rules_dir: str) -> list[tuple[int, str]]:
+    rule_files = []
+    with os.scandir(rules_dir) as entries:
+        for entry in entries:
+            version, extension = os.path.splitext(entry.name)
+            if extension == RULE_FILE_EXTENSION and version.isdigit():
+                rule_files.append((int(version), entry.path))
+    return rule_files
+
+
+def find_latest_rule_file(rules_dir: str) -> tuple[int, str] | None:
+    """Returns version and path of the newest rule file in rules_dir, None if there isn't any"""
+    try:
+        rule_files = _list_rule_files(rules_dir)
+    except FileNotFoundError:
+        return None
+    return max(rule_files, default=None)
+
+
+class MappedSection:
+    """Sorted section of a mapped rule file, supports the in operator through a binary search"""
+
+    __slots__ = ("mapped_file", "data_start", "start", "count")
+
+    def __init__(self, mapped_file: mmap.mmap, data_start: int, start: int, count: int):
+        self.mapped_file = mapped_file
+        self.data_start = data_start
+        self.start = start  # index of the first entry of the section
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> bytes:
+        start, end = struct.unpack_from("<II", self.mapped_file, _HEADER.size + (self.start + index) * _OFFSET.size)
+        return self.mapped_file[self.data_start + start : self.data_start + end]
+
+    def __contains__(self, key: str) -> bool:
+        if not self.count:
+            return False
+
+        key = key.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self[low] == key
+
+
+class RuleFile:
+    """A mapped rule file, call close() once the matcher built from it isn't used anymore"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, self.max_path_segments, self.exception_max_path_segments, self.version, *counts = (
+            _HEADER.unpack_from(self.mapped_file)
+        )
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.mapped_file.close()
+            raise ValueError(f"{path} is not a rule file of format version {FORMAT_VERSION}")
+
+        data_start = _HEADER.size + (sum(counts) + 1) * _OFFSET.size
+        self.sections = []
+        start = 0
+        for count in counts:
+            self.sections.append(MappedSection(self.mapped_file, data_start, start, count))
+            start += count
+
+    def matcher(self) -> UrlMatcher:
+        exceptions = None
+        if any(self.sections[5:]):  # a matcher without exceptions doesn't have to look them up at all
+            exceptions = self._section_matcher(self.sections[5:], self.exception_max_path_segments)
+        return self._section_matcher(self.sections[:5], self.max_path_segments, exceptions)
+
+    @staticmethod
+    def _section_matcher(sections: list, max_path_segments: int, exceptions: UrlMatcher | None = None) -> UrlMatcher:
+        exact_hosts, wildcard_hosts, path_prefixes, path_hosts, regexes = sections
+        return UrlMatcher(
+            exact_hosts,
+            wildcard_hosts,
+            path_prefixes,
+            path_hosts,
+            max_path_segments,
+            [regexes[index].decode() for index in range(len(regexes))],
+            exceptions,
+        )
+
+    def close(self):
+        self.mapped_file.close()
@@ -0,0 +1,230 @@
+"""Matcher of URLs against the compiled rules of the website filter."""
+
+import re
+from collections import OrderedDict
+from enum import Enum
+
+from website_blocker.rule_compiler import CompiledRules
+
+
+def reverse_host(host: str) -> str:
+    """Reverses the labels of host, "www.example.com" -> "com.example.www", so that subdomains share a prefix"""
+    return ".".join(reversed(host.split(".")))
+
+
+def path_prefix_key(reversed_host: str, path_prefix: str) -> str:
+    return f"{reversed_host}\0{path_prefix}"
+
+
+def normalize_request_host(host: str) -> str:
+    host = host.lower().rstrip(".").strip("[]")
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return host
+
+
+def strip_scheme(url: str) -> str:
+    return url.split("://", 1)[-1]
+
+
+def path_segments(url: str, max_segments: int) -> list[str]:
+    """
+    Non empty segments of the path of url without query and fragment, at most max_segments of them. Empty segments
+    and trailing slashes don't matter for path prefixes
+    """
+    url = strip_scheme(url)
+    slash = url.find("/")
+    if slash == -1:
+        return []
+    path = url[slash:].split("?", 1)[0].split("#", 1)[0]
+    return [segment for segment in path.split("/") if segment][:max_segments]
+
+
+class HostDecision(Enum):
+    """Result of matching URLs on their host alone"""
+
+    MATCH = "match"  # every URL of the host matches
+    NO_MATCH = "no_match"  # no URL of the host matches
+    UNDECIDED = "undecided"  # depends on the rest of the URL
+
+
+class UrlMatcher:
+    """
+    Matches URLs against compiled rules in time linear to the length of the URL. Each index only has to support the
+    in operator, so the rules can be sets in memory or sections of a mapped rule file:
+
+        exact_hosts: hosts
+        wildcard_hosts: hosts with their labels reversed, looked up for the host and each of its parent domains
+        path_prefixes: path_prefix_key() of reversed hosts and path prefixes, looked up for the host and each of its
+                       parent domains with every path prefix of the URL up to max_path_segments deep
+        path_hosts: reversed hosts of path_prefixes, so that host_decision() knows which hosts have path rules
+        regexes: patterns, compiled one by one as patterns which are valid on their own can break once joined into a
+                 single alternation, like ones with global flags, named groups or backreferences
+        exceptions: optional UrlMatcher of the exception list, URLs matching it don't match even if the rules do
+    """
+
+    __slots__ = (
+        "exact_hosts",
+        "wildcard_hosts",
+        "path_prefixes",
+        "path_hosts",
+        "max_path_segments",
+        "regexes",
+        "exceptions",
+    )
+
+    def __init__(
+        self,
+        exact_hosts,
+        wildcard_hosts,
+        path_prefixes,
+        path_hosts,
+        max_path_segments: int,
+        regexes: list[str],
+        exceptions: "UrlMatcher | None" = None,
+    ):
+        self.exact_hosts = exact_hosts
+        self.wildcard_hosts = wildcard_hosts
+        self.path_prefixes = path_prefixes
+        self.path_hosts = path_hosts
+        self.max_path_segments = max_path_segments
+        self.regexes = tuple(re.compile(regex, re.IGNORECASE) for regex in regexes)
+        self.exceptions = exceptions
+
+    @classmethod
+    def from_rules(cls, rules: CompiledRules, exception_rules: CompiledRules | None = None):
+        return cls(
+            set(rules.exact_hosts),
+            {reverse_host(host) for host in rules.wildcard_hosts},
+            {path_prefix_key(reverse_host(host), path_prefix) for host, path_prefix in rules.path_prefixes},
+            {reverse_host(host) for host, _ in rules.path_prefixes},
+            rules.max_path_segments(),
+            sorted(rules.regexes),
+            cls.from_rules(exception_rules) if exception_rules else None,
+        )
+
+    def cache_key(self, host: str, url: str) -> tuple:
+        """
+        Key under which the result of matches() can be cached. Host rules depend on nothing but the host and path
+        prefixes only on the first max_path_segments segments of the path. Regexes can match anywhere in the URL, so
+        then the whole URL is part of the key
+        """
+        host = normalize_request_host(host)
+        max_path_segments = self.max_path_segments
+        has_regex = bool(self.regexes)
+        if self.exceptions is not None:
+            max_path_segments = max(max_path_segments, self.exceptions.max_path_segments)
+            has_regex = has_regex or bool(self.exceptions.regexes)
+
+        if has_regex:
+            return host, strip_scheme(url)
+        return host, "/".join(path_segments(url, max_path_segments))
+
+    def matches(self, host: str, url: str) -> bool:
+        # exceptions are only looked at for URLs matching the rules, so a miss costs the same without them
+        if not self._matches_rules(host, url):
+            return False
+        return self.exceptions is None or not self.exceptions.matches(host, url)
+
+    def _matches_rules(self, host: str, url: str) -> bool:
+        host = normalize_request_host(host)
+        if host in self.exact_hosts:
+            return True
+
+        # "/a/b/c" -> "/a", "/a/b", "/a/b/c"
+        segments = path_segments(url, self.max_path_segments)
+        path_prefixes = ["/" + "/".join(segments[:i]) for i in range(1, len(segments) + 1)]
+
+        reversed_host = ""
+        for label in reversed(host.split(".")):
+            reversed_host = f"{reversed_host}.{label}" if reversed_host else label
+            if reversed_host in self.wildcard_hosts:
+                return True
+            if any(path_prefix_key(reversed_host, path_prefix) in self.path_prefixes for path_prefix in path_prefixes):
+                return True
+
+        if not self.regexes:
+            return False
+        url = strip_scheme(url)
+        return any(regex.search(url) is not None for regex in self.regexes)
+
+    def host_decision(self, host: str) -> HostDecision:
+        """
+        Decides whether URLs of host match without looking at the rest of the URL, so that connections can be decided
+        on before their TLS is intercepted. Path prefixes and regexes leave a host undecided
+        """
+        host = normalize_request_host(host)
+        decision = self._host_rules_decision(host)
+        if decision != HostDecision.MATCH or self.exceptions is None:
+            return decision
+
+        exception_decision = self.exceptions.host_decision(host)
+        if exception_decision == HostDecision.MATCH:
+            return HostDecision.NO_MATCH
+        if exception_decision == HostDecision.NO_MATCH:
+            return HostDecision.MATCH
+        return HostDecision.UNDECIDED
+
+    def _host_rules_decision(self, host: str) -> HostDecision:
+        if host in self.exact_hosts:
+            return HostDecision.MATCH
+
+        has_path_rules = False
+        reversed_host = ""
+        for label in reversed(host.split(".")):
+            reversed_host = f"{reversed_host}.{label}" if reversed_host else label
+            if reversed_host in self.wildcard_hosts:
+                return HostDecision.MATCH
+            has_path_rules = has_path_rules or reversed_host in self.path_hosts
+
+        if has_path_rules or self.regexes:
+            return HostDecision.UNDECIDED
+        return HostDecision.NO_MATCH
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of match results. A single page load requests hundreds of resources from a handful of hosts, so
+    most lookups are hits
+    """
+
+    __slots__ = ("maxsize", "entries", "hits", "misses")
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached result for key, or None if it isn't cached"""
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result: bool):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+        }